@@ -0,0 +1,84 @@
+import io
+import logging
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+import metrics
+import profiling
+from config_reload import reload_config, request_shard_reload
+
+
+def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    user = update.effective_user
+    return bool(user) and user.id in context.application.bot_data["admin_ids"]
+
+
+async def handle_perf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not is_admin(update, context):
+        return
+    if not metrics.is_enabled():
+        await message.reply_text("Metrics are disabled. Set METRICS_ENABLED=1 to collect them.")
+        return
+    if context.args and context.args[0].lower() == "reset":
+        metrics.reset()
+        await message.reply_text("Metrics reset.")
+        return
+    await message.reply_text(metrics.format_summary())
+
+
+async def _send_profile(message, seconds: int) -> None:
+    try:
+        report = await profiling.capture_profile(seconds)
+    except RuntimeError as exc:
+        await message.reply_text(str(exc))
+        return
+    try:
+        await message.reply_document(
+            document=io.BytesIO(report.encode()),
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt",
+        )
+    except TelegramError:
+        logging.exception("Failed to send profile")
+
+
+async def handle_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not is_admin(update, context):
+        return
+    seconds = 10
+    if context.args:
+        try:
+            seconds = int(context.args[0])
+        except ValueError:
+            await message.reply_text("Usage: /profile [seconds]")
+            return
+    seconds = max(1, min(seconds, 120))
+    if profiling.is_active():
+        await message.reply_text("A profile capture is already running.")
+        return
+    await message.reply_text(f"Profiling for {seconds}s...")
+    context.application.create_task(_send_profile(message, seconds))
+
+
+async def handle_reload(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not is_admin(update, context):
+        return
+    if "shard" in context.application.bot_data["config"]:
+        request_shard_reload()
+        await message.reply_text("Reload requested for all workers.")
+        return
+    try:
+        version, changed, ignored = await reload_config(context.application)
+    except RuntimeError as exc:
+        await message.reply_text(f"Reload failed, keeping the current config: {exc}")
+        return
+    lines = [f"Config reloaded (version {version})."]
+    lines.append(f"Changed: {', '.join(changed) if changed else 'nothing'}")
+    if ignored:
+        lines.append(f"Requires restart: {', '.join(ignored)}")
+    await message.reply_text("\n".join(lines))
@@ -1,18 +1,84 @@
+import logging
 import os
+from typing import Mapping, Optional
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 
+_startup_env: Optional[dict[str, str]] = None
 
-def load_config() -> dict:
-    load_dotenv()
-    token = os.getenv("BOT_TOKEN")
+
+def _env_bool(env: Mapping[str, str], name: str, default: bool) -> bool:
+    value = env.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(env: Mapping[str, str], name: str, default: int) -> int:
+    value = env.get(name, "").strip()
+    try:
+        return int(value) if value else default
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer") from None
+
+
+def _env_log_level(env: Mapping[str, str], name: str, default: str) -> str:
+    value = env.get(name, "").strip().upper() or default
+    if not isinstance(logging.getLevelName(value), int):
+        raise RuntimeError(f"{name} must be one of DEBUG, INFO, WARNING, ERROR, CRITICAL")
+    return value
+
+
+def _env_log_format(env: Mapping[str, str], name: str, default: str) -> str:
+    value = env.get(name, "").strip().lower() or default
+    if value not in {"json", "text"}:
+        raise RuntimeError(f"{name} must be json or text")
+    return value
+
+
+def _read_env(reload: bool) -> dict[str, str]:
+    global _startup_env
+    if _startup_env is None or not reload:
+        _startup_env = dict(os.environ)
+    env = {name: value for name, value in dotenv_values().items() if value is not None}
+    env.update(_startup_env)
+    return env
+
+
+def load_config(reload: bool = False) -> dict:
+    env = _read_env(reload)
+    token = env.get("BOT_TOKEN")
     if not token:
         raise RuntimeError("BOT_TOKEN is required")
-    admin_ids_raw = os.getenv("ADMIN_IDS", "")
+    admin_ids_raw = env.get("ADMIN_IDS", "")
     admin_ids: set[int] = set()
     for part in admin_ids_raw.split(","):
         part = part.strip()
         if part.isdigit():
             admin_ids.add(int(part))
-    db_path = os.getenv("DB_PATH", "bot.db")
-    return {"token": token, "admin_ids": admin_ids, "db_path": db_path}
+    db_path = env.get("DB_PATH", "bot.db")
+    return {
+        "token": token,
+        "admin_ids": admin_ids,
+        "db_path": db_path,
+        "storage": env.get("STORAGE", "sqlite").strip().lower(),
+        "base_url": env.get("BOT_API_BASE_URL", "").strip() or None,
+        "metrics_enabled": _env_bool(env, "METRICS_ENABLED", False),
+        "metrics_host": env.get("METRICS_HOST", "127.0.0.1"),
+        "metrics_port": _env_int(env, "METRICS_PORT", 0),
+        "slow_query_ms": _env_int(env, "SLOW_QUERY_MS", 0),
+        "loop_lag_ms": _env_int(env, "LOOP_LAG_MS", 100),
+        "workers": max(1, _env_int(env, "WORKERS", 1)),
+        "dedupe_capacity": _env_int(env, "DEDUPE_CAPACITY", 10000),
+        "dedupe_retention_hours": _env_int(env, "DEDUPE_RETENTION_HOURS", 48),
+        "throttle_window": _env_int(env, "THROTTLE_WINDOW", 60),
+        "order_user_limit": _env_int(env, "ORDER_USER_LIMIT", 5),
+        "order_chat_limit": _env_int(env, "ORDER_CHAT_LIMIT", 20),
+        "cancel_user_limit": _env_int(env, "CANCEL_USER_LIMIT", 3),
+        "cancel_chat_limit": _env_int(env, "CANCEL_CHAT_LIMIT", 10),
+        "claim_timeout_minutes": _env_int(env, "CLAIM_TIMEOUT_MINUTES", 30),
+        "shutdown_timeout": _env_int(env, "SHUTDOWN_TIMEOUT", 20),
+        "log_format": _env_log_format(env, "LOG_FORMAT", "json"),
+        "log_level": _env_log_level(env, "LOG_LEVEL", "INFO"),
+        "log_error_window": _env_int(env, "LOG_ERROR_WINDOW", 60),
+    }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import signal
+
+import db
+import logs
+from config import load_config
+
+RESTART_KEYS = {
+    "token",
+    "db_path",
+    "storage",
+    "base_url",
+    "workers",
+    "metrics_enabled",
+    "metrics_host",
+    "metrics_port",
+    "dedupe_capacity",
+    "dedupe_retention_hours",
+    "log_format",
+}
+THROTTLE_KEYS = {
+    "throttle_window",
+    "order_user_limit",
+    "order_chat_limit",
+    "cancel_user_limit",
+    "cancel_chat_limit",
+}
+
+
+def merge_config(current: dict, fresh: dict) -> tuple[dict, list[str], list[str]]:
+    merged = dict(current)
+    changed = []
+    ignored = []
+    for key, value in fresh.items():
+        if current.get(key) == value:
+            continue
+        if key in RESTART_KEYS:
+            ignored.append(key)
+            continue
+        merged[key] = value
+        changed.append(key)
+    return merged, sorted(changed), sorted(ignored)
+
+
+async def _restart_loop_lag_monitor(application, threshold_ms: int) -> None:
+    from profiling import LoopLagMonitor
+
+    monitor = application.bot_data.pop("loop_lag_monitor", None)
+    if monitor is not None:
+        await monitor.stop()
+    if threshold_ms:
+        monitor = LoopLagMonitor(threshold_ms)
+        monitor.start()
+        application.bot_data["loop_lag_monitor"] = monitor
+
+
+async def reload_config(application) -> tuple[int, list[str], list[str]]:
+    from throttle import build_throttles
+
+    bot_data = application.bot_data
+    current = bot_data["config"]
+    fresh = load_config(reload=True)
+    if "shard" in current:
+        from sharding import worker_config
+
+        fresh = worker_config(fresh, current["shard"])
+    config, changed, ignored = merge_config(current, fresh)
+    throttles = build_throttles(config) if THROTTLE_KEYS.intersection(changed) else None
+    if throttles is not None:
+        bot_data["throttles"] = throttles
+    bot_data["config"] = config
+    bot_data["admin_ids"] = config["admin_ids"]
+    version = bot_data["config_version"] = bot_data["config_version"] + 1
+    db.set_slow_query_threshold(config["slow_query_ms"])
+    logging.getLogger().setLevel(logging.getLevelName(config["log_level"]))
+    logs.set_error_window(config["log_error_window"])
+    application.shutdown_timeout = config["shutdown_timeout"]
+    if "loop_lag_ms" in changed:
+        await _restart_loop_lag_monitor(application, config["loop_lag_ms"])
+    logging.info(
+        "Config reloaded (version %s): changed=%s requires_restart=%s",
+        version,
+        ",".join(changed) or "-",
+        ",".join(ignored) or "-",
+    )
+    return version, changed, ignored
+
+
+async def _reload_safe(application) -> None:
+    try:
+        await reload_config(application)
+    except Exception:
+        logging.exception("Config reload failed; keeping the current config")
+
+
+def install_reload_signal(application) -> None:
+    if not hasattr(signal, "SIGHUP"):
+        return
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, lambda: application.create_task(_reload_safe(application))
+    )
+
+
+def remove_reload_signal() -> None:
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+
+
+def request_shard_reload() -> None:
+    os.kill(os.getppid(), signal.SIGHUP)
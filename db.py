@@ -1,85 +1,317 @@
+import asyncio
+import logging
+import time
+
 import aiosqlite
 
-from typing import Optional
+from typing import Any, Callable, Iterable, Optional
 
+import metrics
 
-async def init_db(db_path: str) -> None:
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                status TEXT NOT NULL,
-                type TEXT NOT NULL,
-                cp_pack INTEGER NOT NULL,
-                cp_qty INTEGER NOT NULL,
-                cp_total INTEGER NOT NULL,
-                email TEXT NOT NULL,
-                password TEXT NOT NULL,
-                ign TEXT,
-                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                completed_at TEXT,
-                completed_by INTEGER,
-                cancelled_by INTEGER,
-                rejected_by INTEGER
-            )
-            """
+_slow_query_ms: Optional[float] = None
+_query_observer: Optional[Callable[[str, Any], None]] = None
+
+
+def set_slow_query_threshold(threshold_ms: Optional[float]) -> None:
+    global _slow_query_ms
+    _slow_query_ms = threshold_ms if threshold_ms and threshold_ms > 0 else None
+
+
+def set_query_observer(observer: Optional[Callable[[str, Any], None]]) -> None:
+    global _query_observer
+    _query_observer = observer
+
+
+def _param_shape(params: Iterable[Any]) -> str:
+    return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+
+def _log_if_slow(sql: str, shape: str, started: float, threshold_ms: float) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms >= threshold_ms:
+        logging.warning(
+            "slow query %.1fms params=%s sql=%s", elapsed_ms, shape, " ".join(sql.split())
         )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS order_messages (
-                order_id INTEGER NOT NULL,
-                role TEXT NOT NULL,
-                chat_id INTEGER NOT NULL,
-                message_id INTEGER NOT NULL,
-                PRIMARY KEY (order_id, role),
-                FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
-            )
-            """
+
+
+async def _execute(db: aiosqlite.Connection, sql: str, params: tuple = ()) -> aiosqlite.Cursor:
+    if _query_observer is not None:
+        _query_observer(sql, params)
+    threshold_ms = _slow_query_ms
+    if threshold_ms is None:
+        return await db.execute(sql, params)
+    started = time.perf_counter()
+    cursor = await db.execute(sql, params)
+    _log_if_slow(sql, _param_shape(params), started, threshold_ms)
+    return cursor
+
+
+async def _executemany(db: aiosqlite.Connection, sql: str, rows: list[tuple]) -> aiosqlite.Cursor:
+    if _query_observer is not None and rows:
+        _query_observer(sql, rows[0])
+    threshold_ms = _slow_query_ms
+    if threshold_ms is None:
+        return await db.executemany(sql, rows)
+    started = time.perf_counter()
+    cursor = await db.executemany(sql, rows)
+    shape = f"{len(rows)} x {_param_shape(rows[0])}" if rows else "0 rows"
+    _log_if_slow(sql, shape, started, threshold_ms)
+    return cursor
+
+
+async def _baseline_schema(db: aiosqlite.Connection) -> None:
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            type TEXT NOT NULL,
+            cp_pack INTEGER NOT NULL,
+            cp_qty INTEGER NOT NULL,
+            cp_total INTEGER NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            ign TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TEXT,
+            completed_by INTEGER,
+            cancelled_by INTEGER,
+            rejected_by INTEGER
         )
-        await db.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_order_messages_chat
-            ON order_messages(chat_id, message_id)
-            """
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS order_messages (
+            order_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (order_id, role),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
         )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS routes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                cp_pack INTEGER,
-                chat_id INTEGER NOT NULL,
-                UNIQUE (type, cp_pack)
-            )
-            """
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_messages_chat
+        ON order_messages(chat_id, message_id)
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            cp_pack INTEGER,
+            chat_id INTEGER NOT NULL,
+            UNIQUE (type, cp_pack)
         )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS cancel_requests (
-                order_id INTEGER NOT NULL,
-                worker_chat_id INTEGER NOT NULL,
-                worker_message_id INTEGER NOT NULL,
-                request_message_id INTEGER NOT NULL,
-                status TEXT NOT NULL,
-                decided_by INTEGER,
-                decided_at TEXT,
-                PRIMARY KEY (order_id),
-                FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
-            )
-            """
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS cancel_requests (
+            order_id INTEGER NOT NULL,
+            worker_chat_id INTEGER NOT NULL,
+            worker_message_id INTEGER NOT NULL,
+            request_message_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            decided_by INTEGER,
+            decided_at TEXT,
+            PRIMARY KEY (order_id),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
         )
-        await db.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_orders_status
-            ON orders(status)
-            """
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            currency TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            set_by INTEGER,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (chat_id, message_id),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
         )
-        await db.commit()
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_prices_order
+        ON prices(order_id)
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_prices_created
+        ON prices(created_at, currency)
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_processed_updates_time
+        ON processed_updates(processed_at)
+        """
+    )
+
+
+async def _orders_status_created_index(db: aiosqlite.Connection) -> None:
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_status_created
+        ON orders(status, created_at)
+        """
+    )
+    await _execute(db, "DROP INDEX IF EXISTS idx_orders_status")
+
+
+async def _order_messages_render_columns(db: aiosqlite.Connection) -> None:
+    await _execute(db, "ALTER TABLE order_messages ADD COLUMN render_hash TEXT")
+    await _execute(db, "ALTER TABLE order_messages ADD COLUMN reaction TEXT")
+
+
+async def _orders_claim_columns(db: aiosqlite.Connection) -> None:
+    await _execute(db, "ALTER TABLE orders ADD COLUMN claimed_by INTEGER")
+    await _execute(db, "ALTER TABLE orders ADD COLUMN claimed_at TEXT")
+
+
+async def _orders_claim_indexes(db: aiosqlite.Connection) -> None:
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_claimed_by
+        ON orders(claimed_by, status) WHERE claimed_by IS NOT NULL
+        """
+    )
+    await _execute(
+        db,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_claimed_at
+        ON orders(claimed_at) WHERE claimed_at IS NOT NULL
+        """
+    )
+
+
+async def _pending_updates_table(db: aiosqlite.Connection) -> None:
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS pending_updates (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            saved_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, "baseline schema", False, _baseline_schema),
+    (2, "orders status/created_at index", True, _orders_status_created_index),
+    (3, "order_messages render state", False, _order_messages_render_columns),
+    (4, "orders claim columns", False, _orders_claim_columns),
+    (5, "orders claim indexes", True, _orders_claim_indexes),
+    (6, "pending updates", False, _pending_updates_table),
+]
+
+
+async def _applied_migrations(db: aiosqlite.Connection) -> set[int]:
+    await _execute(
+        db,
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            duration_ms REAL NOT NULL
+        )
+        """
+    )
+    cursor = await _execute(db, "SELECT version FROM schema_migrations")
+    return {row[0] for row in await cursor.fetchall()}
+
+
+async def _record_migration(
+    db: aiosqlite.Connection, version: int, name: str, started: float
+) -> None:
+    elapsed = time.perf_counter() - started
+    await _execute(
+        db,
+        "INSERT OR REPLACE INTO schema_migrations(version, name, duration_ms) VALUES(?, ?, ?)",
+        (version, name, round(elapsed * 1000, 1)),
+    )
+    await db.commit()
+    metrics.observe("migration", name, elapsed)
+    logging.info("Applied migration %s (%s) in %.1fms", version, name, elapsed * 1000)
 
 
+async def init_db(db_path: str) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await _execute(db, "PRAGMA journal_mode = WAL")
+        await _execute(db, "PRAGMA foreign_keys = ON")
+        applied = await _applied_migrations(db)
+        cursor = await _execute(db, "PRAGMA user_version")
+        user_version = (await cursor.fetchone())[0]
+        pending = []
+        for version, name, background, apply in MIGRATIONS:
+            if background:
+                if version not in applied:
+                    pending.append(name)
+                continue
+            if version <= user_version:
+                continue
+            started = time.perf_counter()
+            await _execute(db, "BEGIN")
+            await apply(db)
+            await _execute(db, f"PRAGMA user_version = {version}")
+            await _record_migration(db, version, name, started)
+        if pending:
+            logging.info("Deferred background migrations: %s", ", ".join(pending))
+
+
+async def run_background_migrations(db_path: str, pause: float = 0.05) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        applied = await _applied_migrations(db)
+        for version, name, background, apply in MIGRATIONS:
+            if not background or version in applied:
+                continue
+            started = time.perf_counter()
+            try:
+                while await apply(db):
+                    await db.commit()
+                    await asyncio.sleep(pause)
+            except asyncio.CancelledError:
+                await db.interrupt()
+                raise
+            await _record_migration(db, version, name, started)
+
+
+@metrics.timed("db")
 async def create_order(
     db_path: str,
     order_type: str,
@@ -91,8 +323,9 @@ async def create_order(
     ign: Optional[str],
 ) -> int:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        cursor = await db.execute(
+        await _execute(db, "PRAGMA foreign_keys = ON")
+        cursor = await _execute(
+            db,
             """
             INSERT INTO orders(
                 status,
@@ -111,80 +344,98 @@ async def create_order(
         return cursor.lastrowid
 
 
+@metrics.timed("db")
 async def set_order_message(
-    db_path: str, order_id: int, role: str, chat_id: int, message_id: int
+    db_path: str,
+    order_id: int,
+    role: str,
+    chat_id: int,
+    message_id: int,
+    render_hash: Optional[str] = None,
 ) -> None:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute(
+        await _execute(
+            db,
             """
-            INSERT INTO order_messages(order_id, role, chat_id, message_id)
-            VALUES(?, ?, ?, ?)
+            INSERT INTO order_messages(order_id, role, chat_id, message_id, render_hash)
+            VALUES(?, ?, ?, ?, ?)
             ON CONFLICT(order_id, role) DO UPDATE SET
                 chat_id=excluded.chat_id,
-                message_id=excluded.message_id
+                message_id=excluded.message_id,
+                render_hash=excluded.render_hash,
+                reaction=NULL
             """,
-            (order_id, role, chat_id, message_id),
+            (order_id, role, chat_id, message_id, render_hash),
         )
         await db.commit()
 
 
-async def get_order_by_message(
-    db_path: str, chat_id: int, message_id: int
-) -> Optional[aiosqlite.Row]:
+@metrics.timed("db")
+async def set_message_render(
+    db_path: str, order_id: int, role: str, render_hash: Optional[str], reaction: Optional[str]
+) -> None:
     async with aiosqlite.connect(db_path) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            """
-            SELECT o.* FROM orders o
-            JOIN order_messages m ON o.id = m.order_id
-            WHERE m.chat_id=? AND m.message_id=?
-            """,
-            (chat_id, message_id),
+        await _execute(
+            db,
+            "UPDATE order_messages SET render_hash=?, reaction=? WHERE order_id=? AND role=?",
+            (render_hash, reaction, order_id, role),
         )
-        return await cursor.fetchone()
+        await db.commit()
 
 
-async def get_message_record(
+@metrics.timed("db")
+async def get_order_for_message(
     db_path: str, chat_id: int, message_id: int
 ) -> Optional[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM order_messages WHERE chat_id=? AND message_id=?",
+        cursor = await _execute(
+            db,
+            """
+            SELECT m.role AS message_role, o.* FROM order_messages m
+            JOIN orders o ON o.id = m.order_id
+            WHERE m.chat_id=? AND m.message_id=?
+            """,
             (chat_id, message_id),
         )
         return await cursor.fetchone()
 
 
+@metrics.timed("db")
 async def get_message_record_for_role(
     db_path: str, order_id: int, role: str
 ) -> Optional[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             "SELECT * FROM order_messages WHERE order_id=? AND role=?",
             (order_id, role),
         )
         return await cursor.fetchone()
 
 
+@metrics.timed("db")
 async def get_order_messages(db_path: str, order_id: int) -> list[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             "SELECT * FROM order_messages WHERE order_id=?",
             (order_id,),
         )
         return await cursor.fetchall()
 
 
+@metrics.timed("db")
 async def get_order(db_path: str, order_id: int) -> Optional[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM orders WHERE id=?", (order_id,))
+        cursor = await _execute(db, "SELECT * FROM orders WHERE id=?", (order_id,))
         return await cursor.fetchone()
 
 
+@metrics.timed("db")
 async def update_order_status(
     db_path: str,
     order_id: int,
@@ -195,7 +446,7 @@ async def update_order_status(
     timestamp_field: Optional[str] = None,
 ) -> bool:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute("PRAGMA foreign_keys = ON")
+        await _execute(db, "PRAGMA foreign_keys = ON")
         assignments = ["status = ?", "updated_at = CURRENT_TIMESTAMP"]
         values: list[object] = [to_status]
         if actor_field and actor_id is not None:
@@ -204,7 +455,8 @@ async def update_order_status(
         if timestamp_field:
             assignments.append(f"{timestamp_field} = CURRENT_TIMESTAMP")
         values.extend([order_id, from_status])
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             f"""
             UPDATE orders
             SET {", ".join(assignments)}
@@ -216,50 +468,100 @@ async def update_order_status(
         return cursor.rowcount == 1
 
 
-async def set_route(db_path: str, order_type: str, cp_pack: Optional[int], chat_id: int) -> None:
+@metrics.timed("db")
+async def claim_order(db_path: str, order_id: int, worker_id: int) -> bool:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute(
+        cursor = await _execute(
+            db,
             """
-            INSERT INTO routes(type, cp_pack, chat_id)
-            VALUES(?, ?, ?)
-            ON CONFLICT(type, cp_pack) DO UPDATE SET
-                chat_id=excluded.chat_id
+            UPDATE orders
+            SET claimed_by=?, claimed_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP
+            WHERE id=? AND status IN ('pending', 'pending_cancel') AND claimed_by IS NULL
             """,
-            (order_type, cp_pack, chat_id),
+            (worker_id, order_id),
         )
         await db.commit()
+        return cursor.rowcount == 1
 
 
-async def get_route(db_path: str, order_type: str, cp_pack: int) -> Optional[int]:
+@metrics.timed("db")
+async def release_claim(db_path: str, order_id: int, worker_id: int) -> bool:
     async with aiosqlite.connect(db_path) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT chat_id FROM routes WHERE type=? AND cp_pack=?",
-            (order_type, cp_pack),
+        cursor = await _execute(
+            db,
+            """
+            UPDATE orders
+            SET claimed_by=NULL, claimed_at=NULL, updated_at=CURRENT_TIMESTAMP
+            WHERE id=? AND claimed_by=? AND status IN ('pending', 'pending_cancel')
+            """,
+            (order_id, worker_id),
         )
-        row = await cursor.fetchone()
-        return row["chat_id"] if row else None
+        await db.commit()
+        return cursor.rowcount == 1
 
 
-async def get_main_route(db_path: str) -> Optional[int]:
+@metrics.timed("db")
+async def release_expired_claims(db_path: str, max_age_minutes: int) -> list[int]:
+    async with aiosqlite.connect(db_path) as db:
+        cursor = await _execute(
+            db,
+            """
+            UPDATE orders
+            SET claimed_by=NULL, claimed_at=NULL, updated_at=CURRENT_TIMESTAMP
+            WHERE claimed_at < datetime('now', ?) AND status IN ('pending', 'pending_cancel')
+            RETURNING id
+            """,
+            (f"-{int(max_age_minutes)} minutes",),
+        )
+        released = [row[0] for row in await cursor.fetchall()]
+        await db.commit()
+        return released
+
+
+@metrics.timed("db")
+async def get_claimed_orders(db_path: str, worker_id: int) -> list[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT chat_id FROM routes WHERE type='main' AND cp_pack IS NULL"
+        cursor = await _execute(
+            db,
+            """
+            SELECT * FROM orders
+            WHERE claimed_by=? AND status IN ('pending', 'pending_cancel')
+            ORDER BY claimed_at
+            """,
+            (worker_id,),
+        )
+        return await cursor.fetchall()
+
+
+@metrics.timed("db")
+async def set_route(db_path: str, order_type: str, cp_pack: Optional[int], chat_id: int) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await _execute(
+            db,
+            """
+            INSERT INTO routes(type, cp_pack, chat_id)
+            VALUES(?, ?, ?)
+            ON CONFLICT(type, cp_pack) DO UPDATE SET
+                chat_id=excluded.chat_id
+            """,
+            (order_type, cp_pack, chat_id),
         )
-        row = await cursor.fetchone()
-        return row["chat_id"] if row else None
+        await db.commit()
 
 
+@metrics.timed("db")
 async def list_routes(db_path: str) -> list[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             "SELECT type, cp_pack, chat_id FROM routes ORDER BY type, cp_pack"
         )
         return await cursor.fetchall()
 
 
+@metrics.timed("db")
 async def create_cancel_request(
     db_path: str,
     order_id: int,
@@ -268,7 +570,8 @@ async def create_cancel_request(
     request_message_id: int,
 ) -> None:
     async with aiosqlite.connect(db_path) as db:
-        await db.execute(
+        await _execute(
+            db,
             """
             INSERT OR REPLACE INTO cancel_requests(
                 order_id,
@@ -283,21 +586,25 @@ async def create_cancel_request(
         await db.commit()
 
 
+@metrics.timed("db")
 async def get_cancel_request(db_path: str, order_id: int) -> Optional[aiosqlite.Row]:
     async with aiosqlite.connect(db_path) as db:
         db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             "SELECT * FROM cancel_requests WHERE order_id=?",
             (order_id,),
         )
         return await cursor.fetchone()
 
 
+@metrics.timed("db")
 async def update_cancel_request_status(
     db_path: str, order_id: int, status: str, decided_by: Optional[int]
 ) -> bool:
     async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute(
+        cursor = await _execute(
+            db,
             """
             UPDATE cancel_requests
             SET status=?, decided_by=?, decided_at=CURRENT_TIMESTAMP
@@ -307,3 +614,125 @@ async def update_cancel_request_status(
         )
         await db.commit()
         return cursor.rowcount == 1
+
+
+@metrics.timed("db")
+async def add_prices(
+    db_path: str,
+    rows: list[tuple[int, float, str, int, int, Optional[int], str]],
+) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await _execute(db, "PRAGMA foreign_keys = ON")
+        await _executemany(
+            db,
+            """
+            INSERT OR IGNORE INTO prices(
+                order_id,
+                amount,
+                currency,
+                chat_id,
+                message_id,
+                set_by,
+                created_at
+            ) VALUES(?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        await db.commit()
+
+
+@metrics.timed("db")
+async def get_order_price_totals(db_path: str, order_id: int) -> list[aiosqlite.Row]:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await _execute(
+            db,
+            """
+            SELECT currency, SUM(amount) AS total, COUNT(*) AS count
+            FROM prices
+            WHERE order_id=?
+            GROUP BY currency
+            ORDER BY currency
+            """,
+            (order_id,),
+        )
+        return await cursor.fetchall()
+
+
+@metrics.timed("db")
+async def get_price_totals(db_path: str, days: int) -> list[aiosqlite.Row]:
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await _execute(
+            db,
+            """
+            SELECT currency, SUM(amount) AS total, COUNT(*) AS count,
+                COUNT(DISTINCT order_id) AS orders
+            FROM prices
+            WHERE created_at >= datetime('now', ?)
+            GROUP BY currency
+            ORDER BY currency
+            """,
+            (f"-{days} days",),
+        )
+        return await cursor.fetchall()
+
+
+@metrics.timed("db")
+async def add_processed_updates(db_path: str, rows: list[tuple[int, str]]) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await _executemany(
+            db,
+            "INSERT OR IGNORE INTO processed_updates(update_id, processed_at) VALUES(?, ?)",
+            rows,
+        )
+        await db.commit()
+
+
+@metrics.timed("db")
+async def save_pending_updates(db_path: str, rows: list[tuple[int, str]]) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await _executemany(
+            db,
+            "INSERT OR IGNORE INTO pending_updates(update_id, payload) VALUES(?, ?)",
+            rows,
+        )
+        await db.commit()
+
+
+@metrics.timed("db")
+async def take_pending_updates(db_path: str) -> list[str]:
+    async with aiosqlite.connect(db_path) as db:
+        cursor = await _execute(db, "DELETE FROM pending_updates RETURNING update_id, payload")
+        rows = await cursor.fetchall()
+        await db.commit()
+        return [payload for _, payload in sorted(rows)]
+
+
+@metrics.timed("db")
+async def get_recent_update_ids(db_path: str, limit: int) -> list[int]:
+    async with aiosqlite.connect(db_path) as db:
+        cursor = await _execute(
+            db,
+            "SELECT update_id FROM processed_updates ORDER BY update_id DESC LIMIT ?",
+            (limit,),
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+
+@metrics.timed("db")
+async def prune_processed_updates(db_path: str, max_age_hours: int) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        cursor = await _execute(
+            db,
+            "DELETE FROM processed_updates WHERE processed_at < datetime('now', ?)",
+            (f"-{max_age_hours} hours",),
+        )
+        await db.commit()
+        return cursor.rowcount
+
+
+async def checkpoint_wal(db_path: str) -> tuple[int, int, int]:
+    async with aiosqlite.connect(db_path) as db:
+        cursor = await _execute(db, "PRAGMA wal_checkpoint(TRUNCATE)")
+        return tuple(await cursor.fetchone())
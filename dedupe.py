@@ -0,0 +1,60 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from storage import Storage
+from writebuffer import WriteBuffer
+
+PRUNE_INTERVAL = 3600.0
+
+
+class ProcessedUpdates:
+    def __init__(self, storage: Storage, capacity: int = 10_000, retention_hours: int = 48) -> None:
+        self._storage = storage
+        self._capacity = capacity
+        self._retention_hours = retention_hours
+        self._ids: set[int] = set()
+        self._order: deque[int] = deque()
+        self._last_prune: Optional[float] = None
+        self.buffer = WriteBuffer("processed_updates", self._flush, max_items=100)
+
+    async def load(self) -> None:
+        for update_id in reversed(await self._storage.get_recent_update_ids(self._capacity)):
+            self._remember(update_id)
+        logging.info("Loaded %s processed update ids", len(self._ids))
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._order) >= self._capacity:
+            self._ids.discard(self._order.popleft())
+        self._order.append(update_id)
+        self._ids.add(update_id)
+
+    def check_and_mark(self, update_id: int) -> bool:
+        if update_id in self._ids:
+            return False
+        self._remember(update_id)
+        return True
+
+    def record(self, update_id: int) -> None:
+        self.buffer.add((update_id, datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")))
+
+    async def _flush(self, rows: list[tuple[int, str]]) -> None:
+        await self._storage.add_processed_updates(rows)
+        if self._last_prune is None or time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            await self._storage.prune_processed_updates(self._retention_hours)
+
+
+async def drop_duplicate_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.application.bot_data["processed_updates"].check_and_mark(update.update_id):
+        logging.info("Dropping duplicate update_id=%s", update.update_id)
+        raise ApplicationHandlerStop
+
+
+async def record_processed_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    context.application.bot_data["processed_updates"].record(update.update_id)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        latency_ms: float = 30.0,
+        retry_after_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency_ms / 1000
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls: Counter[str] = Counter()
+        self.throttled: Counter[str] = Counter()
+        self.sent: list[dict] = []
+        self.updates: list[dict] = []
+        self._update_id = 0
+        self._new_updates = asyncio.Event()
+        self._next_message_id: dict[int, int] = {}
+        self._rng = random.Random(seed)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self, port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def push_update(self, update: dict) -> int:
+        self._update_id += 1
+        self.updates.append({"update_id": self._update_id, **update})
+        self._new_updates.set()
+        return self._update_id
+
+    async def _get_updates(self, params: dict[str, Any]) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), float(params.get("timeout") or 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)
+
+    def _message(self, chat_id: int, params: dict[str, Any]) -> dict:
+        message_id = self._next_message_id.get(chat_id, 1_000_000)
+        self._next_message_id[chat_id] = message_id + 1
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        self.sent.append(
+            {"chat_id": chat_id, "message_id": message_id, "text": params.get("text", "")}
+        )
+        return message
+
+    def _respond(self, endpoint: str, params: dict[str, Any]) -> tuple[int, dict]:
+        if (
+            endpoint != "getMe"
+            and self.retry_after_rate
+            and self._rng.random() < self.retry_after_rate
+        ):
+            self.throttled[endpoint] += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        if endpoint == "getMe":
+            result: Any = BOT_USER
+        elif endpoint in {"sendMessage", "sendPhoto", "sendDocument"}:
+            result = self._message(int(params.get("chat_id", 0)), params)
+        elif endpoint == "editMessageText":
+            result = {
+                "message_id": int(params.get("message_id", 0)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "supergroup"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                endpoint = request_line.decode("latin-1").split()[1].rsplit("/", 1)[-1]
+                content_type = headers.get("content-type", "")
+                if content_type.startswith("application/json") and body:
+                    params = json.loads(body)
+                elif content_type.startswith("application/x-www-form-urlencoded"):
+                    params = dict(parse_qsl(body.decode()))
+                else:
+                    params = {}
+                self.calls[endpoint] += 1
+                if self.latency:
+                    await asyncio.sleep(self._rng.expovariate(1 / self.latency))
+                if endpoint == "getUpdates":
+                    status, payload = 200, {"ok": True, "result": await self._get_updates(params)}
+                else:
+                    status, payload = self._respond(endpoint, params)
+                data = json.dumps(payload).encode()
+                reason = "OK" if status == 200 else "Too Many Requests"
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
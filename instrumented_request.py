@@ -0,0 +1,18 @@
+import time
+
+from telegram.request import HTTPXRequest
+
+import metrics
+
+
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+        except BaseException:
+            metrics.observe("telegram", endpoint, time.perf_counter() - started, True)
+            raise
+        metrics.observe("telegram", endpoint, time.perf_counter() - started, status_code >= 400)
+        return status_code, payload
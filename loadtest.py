@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+from telegram import Update
+
+import metrics
+from config import load_config
+from fakebotapi import BOT_USER, FakeBotAPI
+from main import build_application
+from storage import Storage, create_storage
+from utils import VALID_PACKS
+
+ORDER_TYPES = ["safe_fast", "safe_slow", "unsafe", "fund"]
+SOURCE_CHATS = {order_type: -1001000000000 - index for index, order_type in enumerate(ORDER_TYPES)}
+MAIN_SOURCE_CHAT = -1001999999999
+WORKER_IDS = [500 + index for index in range(10)]
+ORDER_ID_PATTERN = re.compile(r"^Order #(\d+)")
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadTest:
+    def __init__(
+        self,
+        application,
+        api: FakeBotAPI,
+        storage: Storage,
+        seed: int,
+        redeliver_rate: float = 0.0,
+    ) -> None:
+        self.application = application
+        self.redeliver_rate = redeliver_rate
+        self.api = api
+        self.storage = storage
+        self.rng = random.Random(seed)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.orders = 0
+        self._update_id = 0
+        self._message_ids: dict[int, int] = defaultdict(int)
+        application.add_error_handler(self._on_error)
+
+    async def _on_error(self, update: object, context) -> None:
+        error = context.error
+        name = type(error).__name__
+        if "locked" in str(error).lower():
+            name = "DatabaseLocked"
+        self.errors[name] += 1
+
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def _message(
+        self,
+        chat_id: int,
+        user_id: int,
+        text: Optional[str] = None,
+        reply_to: Optional[int] = None,
+        photo: bool = False,
+    ) -> dict:
+        self._message_ids[chat_id] += 1
+        message = {
+            "message_id": self._message_ids[chat_id],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+        if photo:
+            message["photo"] = [
+                {"file_id": "photo", "file_unique_id": "photo", "width": 90, "height": 90}
+            ]
+            message["caption"] = "done"
+        if reply_to is not None:
+            message["reply_to_message"] = {
+                "message_id": reply_to,
+                "date": int(time.time()),
+                "chat": message["chat"],
+                "from": BOT_USER,
+                "text": "Order",
+            }
+        return message
+
+    async def _dispatch(self, kind: str, payload: dict) -> None:
+        payload["update_id"] = self._next_update_id()
+        update = Update.de_json(payload, self.application.bot)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies[kind].append(time.perf_counter() - started)
+        if self.redeliver_rate and self.rng.random() < self.redeliver_rate:
+            started = time.perf_counter()
+            await self.application.process_update(update)
+            self.latencies["redelivery"].append(time.perf_counter() - started)
+
+    def _order_text(self, index: int) -> str:
+        order_type = self.rng.choice(ORDER_TYPES)
+        pack = self.rng.choice(VALID_PACKS)
+        return (
+            f"{order_type}\n"
+            f"{pack}x{self.rng.randint(1, 3)}\n"
+            f"customer{index}@example.com\n"
+            f"pass: secret{index}\n"
+            f"ign: player{index}"
+        )
+
+    async def _canonical_messages(self, customer_chat: int) -> Optional[dict[str, int]]:
+        for sent in reversed(self.api.sent):
+            if sent["chat_id"] != customer_chat:
+                continue
+            match = ORDER_ID_PATTERN.match(sent["text"])
+            if not match:
+                return None
+            records = await self.storage.get_order_messages(int(match.group(1)))
+            roles = {record["role"]: record for record in records}
+            if "source" not in roles:
+                return None
+            return {
+                "order_id": int(match.group(1)),
+                "customer": roles["customer"]["message_id"],
+                "source": roles["source"]["message_id"],
+                "source_chat": roles["source"]["chat_id"],
+            }
+        return None
+
+    async def customer(self, index: int) -> None:
+        customer_chat = 10_000 + index
+        await self._dispatch(
+            "new_order", {"message": self._message(customer_chat, customer_chat, self._order_text(index))}
+        )
+        canonical = await self._canonical_messages(customer_chat)
+        if not canonical:
+            return
+        self.orders += 1
+        source_chat = canonical["source_chat"]
+        worker = self.rng.choice(WORKER_IDS)
+        roll = self.rng.random()
+        if roll < 0.35:
+            await self._dispatch(
+                "done", {"message": self._message(source_chat, worker, "done", canonical["source"])}
+            )
+        elif roll < 0.5:
+            await self._dispatch(
+                "photo",
+                {"message": self._message(source_chat, worker, reply_to=canonical["source"], photo=True)},
+            )
+        elif roll < 0.65:
+            await self._dispatch(
+                "wrong", {"message": self._message(source_chat, worker, "wrong", canonical["source"])}
+            )
+        elif roll < 0.85:
+            await self._dispatch(
+                "cancel",
+                {"message": self._message(customer_chat, customer_chat, "cancel", canonical["customer"])},
+            )
+            decision = self.rng.choice(["approve", "reject"])
+            await self._dispatch(
+                "callback",
+                {
+                    "callback_query": {
+                        "id": str(self._next_update_id()),
+                        "from": {"id": worker, "is_bot": False, "first_name": f"user{worker}"},
+                        "chat_instance": str(source_chat),
+                        "data": f"cancel:{canonical['order_id']}:{decision}",
+                        "message": self._message(source_chat, BOT_USER["id"], "Cancel request"),
+                    }
+                },
+            )
+        else:
+            await self._dispatch(
+                "price", {"message": self._message(source_chat, worker, "$12", canonical["source"])}
+            )
+            await self._dispatch(
+                "done", {"message": self._message(source_chat, worker, "done", canonical["source"])}
+            )
+
+    async def run(self, customers: int, concurrency: int) -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(index: int) -> None:
+            async with semaphore:
+                await self.customer(index)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(index) for index in range(customers)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> str:
+        updates = sum(len(values) for values in self.latencies.values())
+        lines = [
+            f"orders: {self.orders} in {elapsed:.2f}s -> {self.orders / elapsed:.1f} orders/s, "
+            f"{updates / elapsed:.1f} updates/s",
+            "",
+            f"{'update':<10} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)",
+        ]
+        for kind in sorted(self.latencies):
+            values = self.latencies[kind]
+            lines.append(
+                f"{kind:<10} {len(values):>7} "
+                f"{_percentile(values, 0.5) * 1000:>8.1f} "
+                f"{_percentile(values, 0.95) * 1000:>8.1f} "
+                f"{_percentile(values, 0.99) * 1000:>8.1f} "
+                f"{max(values) * 1000:>8.1f}"
+            )
+        lines.append("")
+        lines.append(f"{'query':<30} {'count':>7} {'p50':>8} {'p99':>8}  (ms)")
+        for kind, name, histogram in metrics.summary():
+            if kind != "db":
+                continue
+            lines.append(
+                f"{name:<30} {histogram.count:>7} "
+                f"{histogram.quantile(0.5) * 1000:>8.1f} "
+                f"{histogram.quantile(0.99) * 1000:>8.1f}"
+            )
+        lines.append("")
+        lines.append(f"handler errors: {dict(self.errors) or 'none'}")
+        lines.append(f"database lock errors: {self.errors.get('DatabaseLocked', 0)}")
+        lines.append(f"Bot API calls: {dict(self.api.calls)}")
+        lines.append(f"Bot API RetryAfter responses: {dict(self.api.throttled) or 'none'}")
+        return "\n".join(lines)
+
+
+async def _main(args: argparse.Namespace, db_path: str) -> None:
+    api = FakeBotAPI(
+        latency_ms=args.latency_ms,
+        retry_after_rate=args.retry_after_rate,
+        seed=args.seed,
+    )
+    await api.start()
+    os.environ.update(
+        {
+            "BOT_TOKEN": "123456:LOADTEST",
+            "DB_PATH": db_path,
+            "STORAGE": args.storage,
+            "BOT_API_BASE_URL": api.base_url,
+            "METRICS_ENABLED": "1",
+            "METRICS_PORT": "0",
+            "LOOP_LAG_MS": "0",
+            "WORKERS": "1",
+        }
+    )
+    config = load_config()
+    storage = create_storage(config)
+    await storage.init()
+    for order_type, chat_id in SOURCE_CHATS.items():
+        for pack in VALID_PACKS[:3]:
+            await storage.set_route(order_type, pack, chat_id)
+    await storage.set_route("main", None, MAIN_SOURCE_CHAT)
+
+    application = build_application(config, storage)
+    await application.initialize()
+    await application.post_init(application)
+    metrics.reset()
+    loadtest = LoadTest(application, api, storage, args.seed, args.redeliver_rate)
+    try:
+        elapsed = await loadtest.run(args.orders, args.concurrency)
+    finally:
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await api.stop()
+    print(loadtest.report(elapsed))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay order traffic against a fake Bot API.")
+    parser.add_argument("--orders", type=int, default=500, help="customer orders to simulate")
+    parser.add_argument("--concurrency", type=int, default=1, help="customers in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="mean Bot API latency")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--redeliver-rate", type=float, default=0.0, help="share of updates delivered twice")
+    parser.add_argument("--storage", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_main(args, args.db or os.path.join(tmp, "loadtest.db")))
+
+
+if __name__ == "__main__":
+    main()
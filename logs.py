@@ -0,0 +1,140 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Optional
+
+CONTEXT_FIELDS = ("order_id", "chat_id", "handler", "latency_ms")
+
+handler_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("handler", default=None)
+chat_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("chat_id", default=None)
+
+_listener: Optional[QueueListener] = None
+_duplicate_filter: Optional["DuplicateErrorFilter"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ("suppressed",):
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "handler", None) is None:
+            record.handler = handler_var.get()
+        if getattr(record, "chat_id", None) is None:
+            record.chat_id = chat_id_var.get()
+        return True
+
+
+class DuplicateErrorFilter(logging.Filter):
+    def __init__(self, window: float = 60.0) -> None:
+        super().__init__()
+        self.window = window
+        self._seen: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not record.exc_info:
+            return True
+        from telegram.error import TelegramError
+
+        if not isinstance(record.exc_info[1], TelegramError):
+            return True
+        error = record.exc_info[1]
+        key = (record.name, record.msg, type(error), str(error))
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry is not None and now - entry[0] < self.window:
+            entry[1] += 1
+            return False
+        if entry is not None and entry[1]:
+            record.suppressed = entry[1]
+        self._seen[key] = [now, 0]
+        if len(self._seen) > 1000:
+            self._seen = {
+                seen_key: seen for seen_key, seen in self._seen.items() if now - seen[0] < self.window
+            }
+        return True
+
+
+class _LoopQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(
+    json_format: bool = True, level: int = logging.INFO, error_window: float = 60.0
+) -> None:
+    global _listener, _duplicate_filter
+    if _listener is not None:
+        _listener.stop()
+    stream = logging.StreamHandler()
+    if json_format:
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _LoopQueueHandler(log_queue)
+    _duplicate_filter = DuplicateErrorFilter(error_window)
+    queue_handler.addFilter(_duplicate_filter)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def set_error_window(window: float) -> None:
+    if _duplicate_filter is not None:
+        _duplicate_filter.window = window
+
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def traced(func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        chat = getattr(update, "effective_chat", None)
+        handler_token = handler_var.set(func.__name__)
+        chat_token = chat_id_var.set(chat.id if chat else None)
+        started = time.perf_counter()
+        try:
+            return await func(update, context, *args, **kwargs)
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            logging.info("handled in %.2fms", latency_ms, extra={"latency_ms": latency_ms})
+            chat_id_var.reset(chat_token)
+            handler_var.reset(handler_token)
+
+    return wrapper
@@ -1,74 +1,247 @@
-import asyncio
+import json
 import logging
-
-from telegram.ext import (
-    ApplicationBuilder,
-    CallbackQueryHandler,
-    CommandHandler,
-    MessageHandler,
-    filters,
-)
+import time
+from typing import Any, Awaitable
 
 import db
+import metrics
 from config import load_config
-from orders import (
-    handle_cancel_decision,
-    handle_cancel_request,
-    handle_new_order,
-    handle_photo_delivery,
-    handle_worker_action,
-)
-from pricing import handle_price
-from routing import handle_addsource, handle_listsources
-
-
-def _configure_logging() -> None:
-    logging.basicConfig(
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        level=logging.INFO,
-    )
+from logs import configure_logging
+from storage import Storage, create_storage
 
+STARTED = time.perf_counter()
 
-def main() -> None:
-    _configure_logging()
-    config = load_config()
-    asyncio.run(db.init_db(config["db_path"]))
-    application = ApplicationBuilder().token(config["token"]).build()
-    application.bot_data["db_path"] = config["db_path"]
 
-    application.add_handler(
-        CommandHandler("addsource", lambda u, c: handle_addsource(u, c, config["db_path"]))
+def _configure_logging(config: dict) -> None:
+    configure_logging(
+        json_format=config["log_format"] == "json",
+        level=logging.getLevelName(config["log_level"]),
+        error_window=config["log_error_window"],
     )
-    application.add_handler(
-        CommandHandler("listsources", lambda u, c: handle_listsources(u, c, config["db_path"]))
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+async def _warm_up(application) -> None:
+    try:
+        started = time.perf_counter()
+        routes = await application.bot_data["routes"].load(application.bot_data["config_version"])
+        logging.info("Warmed %s routes in %.1fms", routes, _elapsed_ms(started))
+    except Exception:
+        logging.exception("Cache warm-up failed")
+    if application.bot_data["config"].get("shard", 0) != 0:
+        return
+    try:
+        await application.bot_data["storage"].run_background_migrations()
+    except Exception:
+        logging.exception("Background migration failed; it will be retried on next start")
+
+
+async def _record_first_update(update, context) -> None:
+    timings = context.application.bot_data["startup_timings"]
+    if "first_update" not in timings:
+        timings["first_update"] = _elapsed_ms(STARTED)
+        logging.info("First update received %.0fms after start", timings["first_update"])
+
+
+async def _requeue_pending_updates(application) -> None:
+    from telegram import Update
+
+    pending = await application.bot_data["storage"].take_pending_updates()
+    for payload in pending:
+        await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+    if pending:
+        logging.info("Re-queued %s update(s) saved at the last shutdown", len(pending))
+
+
+async def _post_init(application) -> None:
+    from config_reload import install_reload_signal
+    from orders import run_claim_reaper
+    from profiling import LoopLagMonitor
+
+    config = application.bot_data["config"]
+    timings = application.bot_data["startup_timings"]
+    timings["initialize"] = _elapsed_ms(application.bot_data["built_at"])
+    started = time.perf_counter()
+    await application.bot_data["storage"].init()
+    timings["storage_init"] = _elapsed_ms(started)
+    started = time.perf_counter()
+    await application.bot_data["processed_updates"].load()
+    timings["dedupe_load"] = _elapsed_ms(started)
+    if "shard" not in config:
+        await _requeue_pending_updates(application)
+    application.create_background_task(_warm_up(application))
+    if config.get("shard", 0) == 0:
+        application.create_background_task(run_claim_reaper(application))
+    if config["loop_lag_ms"]:
+        monitor = LoopLagMonitor(config["loop_lag_ms"])
+        monitor.start()
+        application.bot_data["loop_lag_monitor"] = monitor
+    if config["metrics_enabled"] and config["metrics_port"]:
+        application.bot_data["metrics_server"] = await metrics.start_http_server(
+            config["metrics_host"], config["metrics_port"]
+        )
+    install_reload_signal(application)
+    timings["ready"] = _elapsed_ms(STARTED)
+    logging.info(
+        "Startup timings: %s", " ".join(f"{name}={value:.0f}ms" for name, value in timings.items())
     )
 
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.REPLY & filters.ChatType.GROUPS,
-            handle_worker_action,
+
+async def _shutdown_step(name: str, step: Awaitable) -> Any:
+    try:
+        return await step
+    except Exception:
+        logging.exception("Shutdown step %s failed", name)
+        return None
+
+
+async def _close_server(server) -> None:
+    server.close()
+    await server.wait_closed()
+
+
+async def _post_shutdown(application) -> None:
+    from config_reload import remove_reload_signal
+
+    remove_reload_signal()
+    monitor = application.bot_data.get("loop_lag_monitor")
+    if monitor is not None:
+        await _shutdown_step("loop_lag_monitor", monitor.stop())
+    server = application.bot_data.get("metrics_server")
+    if server is not None:
+        await _shutdown_step("metrics_server", _close_server(server))
+    prices = await _shutdown_step("price_buffer", application.bot_data["price_buffer"].close())
+    update_ids = await _shutdown_step(
+        "processed_updates", application.bot_data["processed_updates"].buffer.close()
+    )
+    if application.unprocessed_updates:
+        await _shutdown_step(
+            "pending_updates",
+            application.bot_data["storage"].save_pending_updates(
+                [
+                    (update.update_id, json.dumps(update.to_dict()))
+                    for update in application.unprocessed_updates
+                ]
+            ),
         )
+    await _shutdown_step("storage", application.bot_data["storage"].close())
+    stats = application.drain_stats
+    if stats:
+        logging.info(
+            "Shutdown drained %s queued and %s in-flight update(s) in %.0fms (%s saved for restart); "
+            "flushed %s price record(s) and %s update id(s)",
+            stats["queued"],
+            stats["inflight"],
+            stats["drain_ms"],
+            stats["saved"],
+            prices,
+            update_ids,
+        )
+
+
+def build_application(config: dict, storage: Storage):
+    started = time.perf_counter()
+    from telegram import Update
+    from telegram.ext import (
+        ApplicationBuilder,
+        CallbackQueryHandler,
+        CommandHandler,
+        MessageHandler,
+        TypeHandler,
+        filters,
+    )
+
+    from admin import handle_perf, handle_profile, handle_reload
+    from dedupe import ProcessedUpdates, drop_duplicate_update, record_processed_update
+    from orders import (
+        handle_cancel_decision,
+        handle_claim,
+        handle_mine,
+        handle_new_order,
+        handle_photo_delivery,
+        handle_reply,
+    )
+    from pricing import handle_pricereport, handle_pricetotal
+    from routing import RouteCache, handle_addsource, handle_listsources
+    from shutdown import GracefulApplication
+    from throttle import build_throttles
+    from writebuffer import WriteBuffer
+
+    imported = time.perf_counter()
+    metrics.enable(config["metrics_enabled"])
+    db.set_slow_query_threshold(config["slow_query_ms"])
+    builder = (
+        ApplicationBuilder()
+        .application_class(GracefulApplication)
+        .token(config["token"])
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if config["base_url"]:
+        builder = builder.base_url(config["base_url"])
+    if config["metrics_enabled"]:
+        from instrumented_request import InstrumentedRequest
+
+        builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    application = builder.build()
+    application.shutdown_timeout = config["shutdown_timeout"]
+    application.bot_data["config"] = config
+    application.bot_data["config_version"] = 1
+    application.bot_data["storage"] = storage
+    application.bot_data["admin_ids"] = config["admin_ids"]
+    application.bot_data["routes"] = RouteCache(storage)
+    application.bot_data["throttles"] = build_throttles(config)
+    application.bot_data["price_buffer"] = WriteBuffer("prices", storage.add_prices)
+    application.bot_data["processed_updates"] = ProcessedUpdates(
+        storage, config["dedupe_capacity"], config["dedupe_retention_hours"]
     )
+
+    application.add_handler(TypeHandler(Update, _record_first_update), group=-2)
+    application.add_handler(TypeHandler(Update, drop_duplicate_update), group=-1)
+    application.add_handler(TypeHandler(Update, record_processed_update), group=1)
+
+    application.add_handler(CommandHandler("addsource", handle_addsource))
+    application.add_handler(CommandHandler("listsources", handle_listsources))
+    application.add_handler(CommandHandler("pricetotal", handle_pricetotal))
+    application.add_handler(CommandHandler("pricereport", handle_pricereport))
+    application.add_handler(CommandHandler("perf", handle_perf))
+    application.add_handler(CommandHandler("profile", handle_profile))
+    application.add_handler(CommandHandler("reload", handle_reload))
+    application.add_handler(CommandHandler("mine", handle_mine))
+
+    application.add_handler(MessageHandler(filters.TEXT & filters.REPLY, handle_reply))
     application.add_handler(
         MessageHandler(
             filters.PHOTO & filters.REPLY & filters.ChatType.GROUPS,
             handle_photo_delivery,
         )
     )
-
-    application.add_handler(
-        MessageHandler(filters.TEXT & filters.REPLY, handle_cancel_request)
-    )
-    application.add_handler(
-        MessageHandler(filters.TEXT & filters.REPLY, handle_price)
-    )
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_new_order)
     )
 
-    application.add_handler(CallbackQueryHandler(handle_cancel_decision))
+    application.add_handler(CallbackQueryHandler(handle_claim, pattern=r"^(claim|release):\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_cancel_decision, pattern=r"^cancel:"))
+    application.bot_data["startup_timings"] = {
+        "imports": (imported - started) * 1000,
+        "build": _elapsed_ms(imported),
+    }
+    application.bot_data["built_at"] = time.perf_counter()
+    return application
+
+
+def main() -> None:
+    config = load_config()
+    _configure_logging(config)
+    if config["workers"] > 1:
+        from sharding import run_front
 
-    application.run_polling()
+        run_front(config)
+        return
+    build_application(config, create_storage(config)).run_polling()
 
 
 if __name__ == "__main__":
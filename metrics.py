@@ -0,0 +1,192 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_histograms: dict[tuple[str, str], "Histogram"] = {}
+_counters: dict[tuple[str, str], int] = {}
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "errors", "total")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+def enable(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    _histograms.clear()
+    _counters.clear()
+
+
+def observe(kind: str, name: str, seconds: float, error: bool = False) -> None:
+    histogram = _histograms.get((kind, name))
+    if histogram is None:
+        histogram = _histograms[(kind, name)] = Histogram()
+    histogram.observe(seconds, error)
+
+
+def increment(kind: str, name: str) -> None:
+    _counters[(kind, name)] = _counters.get((kind, name), 0) + 1
+
+
+def timed(kind: str, name: Optional[str] = None) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        label = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                error = False
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    observe(kind, label, time.perf_counter() - started, error)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                observe(kind, label, time.perf_counter() - started, error)
+
+        return wrapper
+
+    return decorator
+
+
+def summary() -> list[tuple[str, str, Histogram]]:
+    return [(kind, name, _histograms[(kind, name)]) for kind, name in sorted(_histograms)]
+
+
+def render_prometheus() -> str:
+    lines = [
+        "# HELP bot_latency_seconds Latency of handlers, queries and Bot API calls.",
+        "# TYPE bot_latency_seconds histogram",
+    ]
+    errors = [
+        "# HELP bot_errors_total Failed handler, query and Bot API calls.",
+        "# TYPE bot_errors_total counter",
+    ]
+    for kind, name, histogram in summary():
+        labels = f'kind="{kind}",name="{name}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram.buckets):
+            cumulative += bucket_count
+            lines.append(f'bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'bot_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"bot_latency_seconds_sum{{{labels}}} {histogram.total}")
+        lines.append(f"bot_latency_seconds_count{{{labels}}} {histogram.count}")
+        errors.append(f"bot_errors_total{{{labels}}} {histogram.errors}")
+    events = [
+        "# HELP bot_events_total Counted events such as throttled requests.",
+        "# TYPE bot_events_total counter",
+    ]
+    for (kind, name), count in sorted(_counters.items()):
+        events.append(f'bot_events_total{{kind="{kind}",name="{name}"}} {count}')
+    return "\n".join(lines + errors + events) + "\n"
+
+
+def format_summary() -> str:
+    rows = summary()
+    if not rows and not _counters:
+        return "No measurements yet."
+    lines = ["kind/name: count err p50 p95 p99 (ms)"] if rows else []
+    for kind, name, histogram in rows:
+        lines.append(
+            f"{kind}/{name}: {histogram.count} {histogram.errors} "
+            f"{histogram.quantile(0.5) * 1000:.1f} "
+            f"{histogram.quantile(0.95) * 1000:.1f} "
+            f"{histogram.quantile(0.99) * 1000:.1f}"
+        )
+    if _counters:
+        lines.append("kind/name: count")
+    for (kind, name), count in sorted(_counters.items()):
+        lines.append(f"{kind}/{name}: {count}")
+    return "\n".join(lines)
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+            status = "200 OK"
+            body = render_prometheus().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logging.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
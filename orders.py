@@ -1,64 +1,110 @@
+import asyncio
 import logging
 from typing import Optional
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import TelegramError
+from telegram.constants import ChatType
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import ContextTypes
 
-import db
+import metrics
+from admin import is_admin
+from logs import traced
+from pricing import record_price
+from storage import OPEN_STATUSES, Storage
+from throttle import throttled
 from utils import (
     build_canonical_message,
     canonical_status,
-    is_cancel_text,
-    is_done_text,
-    is_wrong_text,
+    classify_reply,
     parse_order,
+    render_hash,
 )
 
 
-async def _react_safe(bot, chat_id: int, message_id: int, reaction: str) -> None:
+async def _react_safe(bot, chat_id: int, message_id: int, reaction: str) -> bool:
+    if not hasattr(bot, "set_message_reaction"):
+        return False
     try:
-        if hasattr(bot, "set_message_reaction"):
-            await bot.set_message_reaction(
-                chat_id=chat_id, message_id=message_id, reaction=reaction
-            )
+        await bot.set_message_reaction(
+            chat_id=chat_id, message_id=message_id, reaction=reaction
+        )
     except TelegramError:
         logging.exception("Failed to set reaction")
+        return False
+    return True
 
 
-async def _edit_message_safe(bot, chat_id: int, message_id: int, text: str) -> None:
+async def _edit_message_safe(
+    bot, chat_id: int, message_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None
+) -> bool:
     try:
-        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup
+        )
+    except BadRequest as exc:
+        if "message is not modified" in str(exc).lower():
+            return True
+        logging.exception("Failed to edit message")
+        return False
     except TelegramError:
         logging.exception("Failed to edit message")
+        return False
+    return True
 
 
-async def _load_order(db_path: str, order_id: int) -> Optional[dict]:
-    row = await db.get_order(db_path, order_id)
+async def _load_order(storage: Storage, order_id: int) -> Optional[dict]:
+    row = await storage.get_order(order_id)
     return dict(row) if row else None
 
 
-async def _update_canonical_messages(context: ContextTypes.DEFAULT_TYPE, db_path: str, order_id: int) -> None:
-    order = await _load_order(db_path, order_id)
+def _source_keyboard(order: dict) -> Optional[InlineKeyboardMarkup]:
+    if order["status"] not in OPEN_STATUSES:
+        return None
+    if order["claimed_by"] is None:
+        button = InlineKeyboardButton("✋ Claim", callback_data=f"claim:{order['id']}")
+    else:
+        button = InlineKeyboardButton("🔒 Claimed · Release", callback_data=f"release:{order['id']}")
+    return InlineKeyboardMarkup([[button]])
+
+
+def _render_state(text: str, keyboard: Optional[InlineKeyboardMarkup]) -> str:
+    if keyboard is None:
+        return render_hash(text)
+    buttons = "|".join(button.callback_data for row in keyboard.inline_keyboard for button in row)
+    return render_hash(f"{text}\n{buttons}")
+
+
+async def _update_canonical_messages(bot, storage: Storage, order_id: int) -> None:
+    order = await _load_order(storage, order_id)
     if not order:
         return
     text = build_canonical_message(order)
-    messages = await db.get_order_messages(db_path, order_id)
-    for message in messages:
-        await _edit_message_safe(
-            context.bot, message["chat_id"], message["message_id"], text
-        )
+    source_keyboard = _source_keyboard(order)
     if order["status"] == "completed":
         reaction = "✅"
     elif order["status"] in {"cancelled", "rejected"}:
         reaction = "👎"
     else:
-        reaction = ""
-    if reaction:
-        for message in messages:
-            await _react_safe(context.bot, message["chat_id"], message["message_id"], reaction)
-
-
+        reaction = None
+    for message in await storage.get_order_messages(order_id):
+        keyboard = source_keyboard if message["role"] == "source" else None
+        state = _render_state(text, keyboard)
+        rendered, reacted = message["render_hash"], message["reaction"]
+        if rendered != state and await _edit_message_safe(
+            bot, message["chat_id"], message["message_id"], text, keyboard
+        ):
+            rendered = state
+        if reaction and reacted != reaction and await _react_safe(
+            bot, message["chat_id"], message["message_id"], reaction
+        ):
+            reacted = reaction
+        if (rendered, reacted) != (message["render_hash"], message["reaction"]):
+            await storage.set_message_render(order_id, message["role"], rendered, reacted)
+
+
+@metrics.timed("handler")
+@traced
 async def handle_new_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     if not message or not message.text:
@@ -67,6 +113,8 @@ async def handle_new_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     parsed = parse_order(message.text)
     if not parsed:
         return
+    if await throttled(message, context, "order"):
+        return
 
     if not parsed.order_type:
         await message.reply_text(
@@ -89,10 +137,11 @@ async def handle_new_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return
 
-    db_path = context.application.bot_data["db_path"]
-    route = await db.get_route(db_path, parsed.order_type, parsed.cp_pack)
-    if route is None:
-        route = await db.get_main_route(db_path)
+    bot_data = context.application.bot_data
+    storage = bot_data["storage"]
+    route = await bot_data["routes"].resolve(
+        parsed.order_type, parsed.cp_pack, bot_data["config_version"]
+    )
     if route is None:
         await message.reply_text(
             "در حال حاضر گروه پشتیبان موجود نیست. لطفاً بعداً تلاش کنید.\n"
@@ -100,8 +149,7 @@ async def handle_new_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return
 
-    order_id = await db.create_order(
-        db_path=db_path,
+    order_id = await storage.create_order(
         order_type=parsed.order_type,
         cp_pack=parsed.cp_pack,
         cp_qty=parsed.cp_qty,
@@ -110,146 +158,120 @@ async def handle_new_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         password=parsed.password,
         ign=parsed.ign,
     )
-    order = await _load_order(db_path, order_id)
+    order = await _load_order(storage, order_id)
     if not order:
         return
     canonical = build_canonical_message(order)
     customer_message = await message.reply_text(canonical)
-    await db.set_order_message(
-        db_path, order_id, "customer", message.chat.id, customer_message.message_id
+    await storage.set_order_message(
+        order_id, "customer", message.chat.id, customer_message.message_id, render_hash(canonical)
     )
-    source_message = await context.bot.send_message(chat_id=route, text=canonical)
-    await db.set_order_message(
-        db_path, order_id, "source", route, source_message.message_id
+    keyboard = _source_keyboard(order)
+    source_message = await context.bot.send_message(
+        chat_id=route, text=canonical, reply_markup=keyboard
     )
-    logging.info("order_id=%s status=%s", order_id, order["status"])
-
-
-async def handle_worker_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message = update.effective_message
-    if not message or not message.reply_to_message:
-        return
-    if not message.text:
-        return
-    if not (is_done_text(message.text) or is_wrong_text(message.text)):
-        return
-
-    db_path = context.application.bot_data["db_path"]
-    record = await db.get_message_record(
-        db_path, message.chat.id, message.reply_to_message.message_id
+    await storage.set_order_message(
+        order_id, "source", route, source_message.message_id, _render_state(canonical, keyboard)
+    )
+    logging.info(
+        "order_id=%s status=%s", order_id, order["status"], extra={"order_id": order_id}
     )
-    if not record or record["role"] != "source":
-        return
 
-    order_id = record["order_id"]
-    order = await _load_order(db_path, order_id)
-    if not order:
-        return
 
-    if is_done_text(message.text):
-        if order["status"] == "cancelled":
-            await message.reply_text("Order is cancelled; delivery rejected.")
-            return
-        if order["status"] != "pending":
-            await message.reply_text(
-                f"Order status is {canonical_status(order['status'])[0]}."
-            )
-            return
-        updated = await db.update_order_status(
-            db_path,
-            order_id,
-            "pending",
-            "completed",
-            actor_field="completed_by",
-            actor_id=message.from_user.id if message.from_user else None,
-            timestamp_field="completed_at",
-        )
-        if not updated:
-            await message.reply_text("Order already reviewed.")
-            return
-        logging.info("order_id=%s status=completed", order_id)
-        await _update_canonical_messages(context, db_path, order_id)
-        return
+async def _load_message_order(
+    storage: Storage, chat_id: int, message_id: int
+) -> tuple[Optional[str], Optional[dict]]:
+    row = await storage.get_order_for_message(chat_id, message_id)
+    if not row:
+        return None, None
+    order = dict(row)
+    return order.pop("message_role"), order
+
 
+async def complete_order(message, context: ContextTypes.DEFAULT_TYPE, order: dict) -> None:
     if order["status"] == "cancelled":
-        await message.reply_text("Order is cancelled; rejection not needed.")
+        await message.reply_text("Order is cancelled; delivery rejected.")
         return
     if order["status"] != "pending":
         await message.reply_text(
             f"Order status is {canonical_status(order['status'])[0]}."
         )
         return
-    updated = await db.update_order_status(
-        db_path,
-        order_id,
+    if order["claimed_by"] is not None and (
+        not message.from_user or message.from_user.id != order["claimed_by"]
+    ):
+        await message.reply_text(f"Order #{order['id']} is claimed by another worker.")
+        return
+    storage = context.application.bot_data["storage"]
+    updated = await storage.update_order_status(
+        order["id"],
         "pending",
-        "rejected",
-        actor_field="rejected_by",
+        "completed",
+        actor_field="completed_by",
         actor_id=message.from_user.id if message.from_user else None,
+        timestamp_field="completed_at",
     )
     if not updated:
         await message.reply_text("Order already reviewed.")
         return
-    logging.info("order_id=%s status=rejected", order_id)
-    await _update_canonical_messages(context, db_path, order_id)
+    logging.info(
+        "order_id=%s status=completed%s",
+        order["id"],
+        " (photo)" if message.photo else "",
+        extra={"order_id": order["id"]},
+    )
+    await _update_canonical_messages(context.bot, storage, order["id"])
 
 
-async def handle_photo_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message = update.effective_message
-    if not message or not message.photo or not message.reply_to_message:
-        return
-    caption = message.caption or ""
-    if "done" not in caption.lower():
-        return
-    db_path = context.application.bot_data["db_path"]
-    record = await db.get_message_record(
-        db_path, message.chat.id, message.reply_to_message.message_id
-    )
-    if not record or record["role"] != "source":
-        return
-    order = await _load_order(db_path, record["order_id"])
-    if not order:
-        return
+async def reject_order(message, context: ContextTypes.DEFAULT_TYPE, order: dict) -> None:
     if order["status"] == "cancelled":
-        await message.reply_text("Order is cancelled; delivery rejected.")
+        await message.reply_text("Order is cancelled; rejection not needed.")
         return
     if order["status"] != "pending":
         await message.reply_text(
             f"Order status is {canonical_status(order['status'])[0]}."
         )
         return
-    updated = await db.update_order_status(
-        db_path,
+    if order["claimed_by"] is not None and (
+        not message.from_user or message.from_user.id != order["claimed_by"]
+    ):
+        await message.reply_text(f"Order #{order['id']} is claimed by another worker.")
+        return
+    storage = context.application.bot_data["storage"]
+    updated = await storage.update_order_status(
         order["id"],
         "pending",
-        "completed",
-        actor_field="completed_by",
+        "rejected",
+        actor_field="rejected_by",
         actor_id=message.from_user.id if message.from_user else None,
-        timestamp_field="completed_at",
     )
     if not updated:
         await message.reply_text("Order already reviewed.")
         return
-    logging.info("order_id=%s status=completed (photo)", order["id"])
-    await _update_canonical_messages(context, db_path, order["id"])
+    logging.info("order_id=%s status=rejected", order["id"], extra={"order_id": order["id"]})
+    await _update_canonical_messages(context.bot, storage, order["id"])
 
 
-async def handle_cancel_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@metrics.timed("handler")
+@traced
+async def handle_photo_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
-    if not message or not message.reply_to_message or not message.text:
+    if not message or not message.photo or not message.reply_to_message:
         return
-    if not is_cancel_text(message.text):
+    caption = message.caption or ""
+    if "done" not in caption.lower():
         return
-
-    db_path = context.application.bot_data["db_path"]
-    record = await db.get_message_record(
-        db_path, message.chat.id, message.reply_to_message.message_id
+    storage = context.application.bot_data["storage"]
+    role, order = await _load_message_order(
+        storage, message.chat.id, message.reply_to_message.message_id
     )
-    if not record or record["role"] != "customer":
-        return
-    order = await _load_order(db_path, record["order_id"])
-    if not order:
+    if not order or role != "source":
         return
+    await complete_order(message, context, order)
+
+
+async def request_cancel(message, context: ContextTypes.DEFAULT_TYPE, order: dict) -> None:
+    storage = context.application.bot_data["storage"]
     if order["status"] == "completed":
         await message.reply_text(
             "سفارش قبلاً تکمیل شده و قابل لغو نیست.\n"
@@ -275,7 +297,7 @@ async def handle_cancel_request(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
 
-    updated = await db.update_order_status(db_path, order["id"], "pending", "pending_cancel")
+    updated = await storage.update_order_status(order["id"], "pending", "pending_cancel")
     if not updated:
         await message.reply_text(
             "درخواست لغو ثبت نشد. لطفاً دوباره تلاش کنید.\n"
@@ -283,7 +305,7 @@ async def handle_cancel_request(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
 
-    source_message = await db.get_message_record_for_role(db_path, order["id"], "source")
+    source_message = await storage.get_message_record_for_role(order["id"], "source")
     if not source_message:
         await message.reply_text(
             "این سفارش به گروه منبع ارسال نشده است.\n"
@@ -305,21 +327,56 @@ async def handle_cancel_request(update: Update, context: ContextTypes.DEFAULT_TY
         text=f"Cancel request for Order #{order['id']}",
         reply_markup=keyboard,
     )
-    await db.create_cancel_request(
-        db_path,
+    await storage.create_cancel_request(
         order["id"],
         source_message["chat_id"],
         source_message["message_id"],
         request_message.message_id,
     )
-    logging.info("order_id=%s status=pending_cancel", order["id"])
-    await _update_canonical_messages(context, db_path, order["id"])
+    logging.info("order_id=%s status=pending_cancel", order["id"], extra={"order_id": order["id"]})
+    await _update_canonical_messages(context.bot, storage, order["id"])
     await message.reply_text(
         "درخواست لغو برای تیم ارسال شد. به‌زودی اطلاع می‌دهیم.\n"
         "Cancel request sent to the team. We will update you shortly."
     )
 
 
+@metrics.timed("handler")
+@traced
+async def handle_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not message.text or not message.reply_to_message:
+        return
+    kind, price = classify_reply(message.text)
+    if kind == "other":
+        return
+    if kind in {"done", "wrong"} and message.chat.type not in {ChatType.GROUP, ChatType.SUPERGROUP}:
+        return
+    if kind == "cancel" and await throttled(message, context, "cancel"):
+        return
+
+    storage = context.application.bot_data["storage"]
+    role, order = await _load_message_order(
+        storage, message.chat.id, message.reply_to_message.message_id
+    )
+    if not order:
+        return
+
+    if kind == "done":
+        if role == "source":
+            await complete_order(message, context, order)
+    elif kind == "wrong":
+        if role == "source":
+            await reject_order(message, context, order)
+    elif kind == "cancel":
+        if role == "customer":
+            await request_cancel(message, context, order)
+    elif role == "source" or is_admin(update, context):
+        await record_price(message, context, order, price)
+
+
+@metrics.timed("handler")
+@traced
 async def handle_cancel_decision(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     if not query or not query.data:
@@ -329,9 +386,9 @@ async def handle_cancel_decision(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     _, order_id_str, decision = query.data.split(":")
     order_id = int(order_id_str)
-    db_path = context.application.bot_data["db_path"]
+    storage = context.application.bot_data["storage"]
 
-    request = await db.get_cancel_request(db_path, order_id)
+    request = await storage.get_cancel_request(order_id)
     if not request:
         await query.edit_message_text("Cancel request not found.")
         return
@@ -340,8 +397,7 @@ async def handle_cancel_decision(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     if decision == "approve":
-        updated = await db.update_order_status(
-            db_path,
+        updated = await storage.update_order_status(
             order_id,
             "pending_cancel",
             "cancelled",
@@ -351,19 +407,85 @@ async def handle_cancel_decision(update: Update, context: ContextTypes.DEFAULT_T
         if not updated:
             await query.edit_message_text("Order already reviewed.")
             return
-        await db.update_cancel_request_status(db_path, order_id, "approved", query.from_user.id)
-        logging.info("order_id=%s status=cancelled", order_id)
-        await _update_canonical_messages(context, db_path, order_id)
+        await storage.update_cancel_request_status(order_id, "approved", query.from_user.id)
+        logging.info("order_id=%s status=cancelled", order_id, extra={"order_id": order_id})
+        await _update_canonical_messages(context.bot, storage, order_id)
         await query.edit_message_text(f"Order #{order_id} cancelled.")
         return
 
     if decision == "reject":
-        updated = await db.update_order_status(db_path, order_id, "pending_cancel", "pending")
+        updated = await storage.update_order_status(order_id, "pending_cancel", "pending")
         if not updated:
             await query.edit_message_text("Order already reviewed.")
             return
-        await db.update_cancel_request_status(db_path, order_id, "rejected", query.from_user.id)
-        logging.info("order_id=%s status=pending", order_id)
-        await _update_canonical_messages(context, db_path, order_id)
+        await storage.update_cancel_request_status(order_id, "rejected", query.from_user.id)
+        logging.info("order_id=%s status=pending", order_id, extra={"order_id": order_id})
+        await _update_canonical_messages(context.bot, storage, order_id)
         await query.edit_message_text(f"Cancel request rejected for Order #{order_id}.")
         return
+
+
+@metrics.timed("handler")
+@traced
+async def handle_claim(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if not query or not query.data or not query.from_user:
+        return
+    action, order_id_str = query.data.split(":", 1)
+    order_id = int(order_id_str)
+    storage = context.application.bot_data["storage"]
+    worker_id = query.from_user.id
+
+    if action == "claim":
+        if not await storage.claim_order(order_id, worker_id):
+            await query.answer("This order is already claimed or closed.", show_alert=True)
+            return
+        await query.answer(f"Order #{order_id} is yours. See /mine for your queue.")
+        logging.info(
+            "order_id=%s claimed_by=%s", order_id, worker_id, extra={"order_id": order_id}
+        )
+    else:
+        if not await storage.release_claim(order_id, worker_id):
+            await query.answer(
+                "Only the worker who claimed this order can release it.", show_alert=True
+            )
+            return
+        await query.answer(f"Order #{order_id} released.")
+        logging.info(
+            "order_id=%s released_by=%s", order_id, worker_id, extra={"order_id": order_id}
+        )
+    await _update_canonical_messages(context.bot, storage, order_id)
+
+
+@metrics.timed("handler")
+@traced
+async def handle_mine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    user = update.effective_user
+    if not message or not user:
+        return
+    orders = await context.application.bot_data["storage"].get_claimed_orders(user.id)
+    if not orders:
+        await message.reply_text("You have no claimed orders.")
+        return
+    lines = [
+        f"#{order['id']} {order['type']} {order['cp_pack']}x{order['cp_qty']} - "
+        f"{canonical_status(order['status'])[0]} (claimed {order['claimed_at']} UTC)"
+        for order in orders
+    ]
+    await message.reply_text("Your claimed orders:\n" + "\n".join(lines))
+
+
+async def run_claim_reaper(application, interval: float = 60.0) -> None:
+    storage = application.bot_data["storage"]
+    while True:
+        await asyncio.sleep(interval)
+        timeout_minutes = application.bot_data["config"]["claim_timeout_minutes"]
+        if not timeout_minutes:
+            continue
+        try:
+            for order_id in await storage.release_expired_claims(timeout_minutes):
+                logging.info("order_id=%s claim expired", order_id, extra={"order_id": order_id})
+                await _update_canonical_messages(application.bot, storage, order_id)
+        except Exception:
+            logging.exception("Failed to release expired claims")
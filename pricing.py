@@ -1,35 +1,94 @@
 import logging
+from datetime import datetime, timezone
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
-import db
-from utils import parse_price_amount
-
-
-async def handle_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message = update.effective_message
-    if not message or not message.text or not message.reply_to_message:
-        return
+import metrics
+from admin import is_admin
+from logs import traced
 
-    parsed = parse_price_amount(message.text)
-    if not parsed:
-        return
 
-    db_path = context.application.bot_data["db_path"]
-    record = await db.get_message_record(
-        db_path, message.chat.id, message.reply_to_message.message_id
+async def record_price(
+    message, context: ContextTypes.DEFAULT_TYPE, order: dict, price: tuple[float, str]
+) -> None:
+    amount, currency = price
+    context.application.bot_data["price_buffer"].add(
+        (
+            order["id"],
+            amount,
+            currency,
+            message.chat.id,
+            message.message_id,
+            message.from_user.id if message.from_user else None,
+            datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        )
     )
-    if not record:
-        return
-
-    amount, currency = parsed
     logging.info(
         "pricing order_id=%s amount=%s currency=%s",
-        record["order_id"],
+        order["id"],
         amount,
         currency,
+        extra={"order_id": order["id"]},
     )
     await message.reply_text(
         f"قیمت ثبت شد: {amount} {currency}\n"
         f"Pricing noted: {amount} {currency}"
     )
+
+
+@metrics.timed("handler")
+@traced
+async def handle_pricetotal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not is_admin(update, context):
+        return
+    args = context.args
+    if not args:
+        await message.reply_text("Usage: /pricetotal <order_id>")
+        return
+    try:
+        order_id = int(args[0].lstrip("#"))
+    except ValueError:
+        await message.reply_text("Order id must be a number.")
+        return
+    storage = context.application.bot_data["storage"]
+    await context.application.bot_data["price_buffer"].flush()
+    rows = await storage.get_order_price_totals(order_id)
+    if not rows:
+        await message.reply_text(f"No prices recorded for Order #{order_id}.")
+        return
+    lines = [f"Order #{order_id} totals:"] + [
+        f"{row['currency']}: {row['total']:g} ({row['count']} entries)" for row in rows
+    ]
+    await message.reply_text("\n".join(lines))
+
+
+@metrics.timed("handler")
+@traced
+async def handle_pricereport(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message or not is_admin(update, context):
+        return
+    args = context.args
+    days = 7
+    if args:
+        try:
+            days = int(args[0])
+        except ValueError:
+            await message.reply_text("Usage: /pricereport [days]")
+            return
+        if days <= 0:
+            await message.reply_text("Days must be positive.")
+            return
+    storage = context.application.bot_data["storage"]
+    await context.application.bot_data["price_buffer"].flush()
+    rows = await storage.get_price_totals(days)
+    if not rows:
+        await message.reply_text(f"No prices recorded in the last {days} days.")
+        return
+    lines = [f"Totals for the last {days} days:"] + [
+        f"{row['currency']}: {row['total']:g} ({row['count']} entries, {row['orders']} orders)"
+        for row in rows
+    ]
+    await message.reply_text("\n".join(lines))
@@ -0,0 +1,83 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+from typing import Optional
+
+import metrics
+
+_active = False
+
+
+def is_active() -> bool:
+    return _active
+
+
+def dump_tasks() -> str:
+    buffer = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    buffer.write(f"{len(tasks)} asyncio tasks\n")
+    for task in tasks:
+        coro = task.get_coro()
+        buffer.write(f"\n--- {task.get_name()} {getattr(coro, '__qualname__', coro)}\n")
+        task.print_stack(limit=10, file=buffer)
+    return buffer.getvalue()
+
+
+async def capture_profile(seconds: float, top: int = 40) -> str:
+    global _active
+    if _active:
+        raise RuntimeError("A profile capture is already running")
+    _active = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        await asyncio.sleep(seconds)
+        profiler.disable()
+        tasks = dump_tasks()
+    finally:
+        profiler.disable()
+        _active = False
+
+    buffer = io.StringIO()
+    buffer.write(f"Profile of the event loop thread for {seconds:g}s\n\n")
+    stats = pstats.Stats(profiler, stream=buffer)
+    buffer.write("=== Top functions by own time ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    buffer.write("=== Top functions by cumulative time ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    buffer.write("=== Tasks at end of capture ===\n")
+    buffer.write(tasks)
+    return buffer.getvalue()
+
+
+class LoopLagMonitor:
+    def __init__(self, threshold_ms: float, interval: float = 0.5) -> None:
+        self._threshold = threshold_ms / 1000
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            lag = time.perf_counter() - started - self._interval
+            if metrics.is_enabled():
+                metrics.observe("loop", "lag", max(lag, 0.0))
+            if lag >= self._threshold:
+                logging.warning("Event loop blocked for %.0fms", lag * 1000)
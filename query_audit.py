@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from typing import Any
+
+import db
+
+ALLOWED_SCANS = {
+    "list_routes": "admin listing, bounded by the number of configured routes",
+    "get_recent_update_ids": "reverse primary-key walk stopped by LIMIT, startup only",
+    "take_pending_updates": "drains updates saved at shutdown, startup only",
+}
+MAINTENANCE_FUNCTIONS = {"init_db", "run_background_migrations", "checkpoint_wal"}
+ORDER_TYPES = ["safe_fast", "safe_slow", "unsafe", "fund"]
+PACKS = [80, 420, 880, 2400, 5000, 10800]
+STATUSES = ["pending", "pending_cancel", "completed", "cancelled", "rejected"]
+
+
+def seed(db_path: str, order_count: int) -> None:
+    rng = random.Random(1)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO orders(status, type, cp_pack, cp_qty, cp_total, email, password, ign)"
+        " VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                rng.choice(STATUSES),
+                rng.choice(ORDER_TYPES),
+                pack,
+                qty,
+                pack * qty,
+                f"user{index}@example.com",
+                "secret",
+                None,
+            )
+            for index in range(order_count)
+            for pack, qty in [(rng.choice(PACKS), rng.randint(1, 3))]
+        ),
+    )
+    conn.execute(
+        "UPDATE orders SET claimed_by = 500 + id % 10,"
+        " claimed_at = datetime('now', '-' || (id % 120) || ' minutes')"
+        " WHERE id % 7 = 0 AND status IN ('pending', 'pending_cancel')"
+    )
+    conn.executemany(
+        "INSERT INTO order_messages(order_id, role, chat_id, message_id) VALUES(?, ?, ?, ?)",
+        (
+            (order_id, role, chat_id, order_id * 2 + offset)
+            for order_id in range(1, order_count + 1)
+            for role, chat_id, offset in (("customer", 1000 + order_id % 50, 0), ("source", -100 - order_id % 10, 1))
+        ),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO routes(type, cp_pack, chat_id) VALUES(?, ?, ?)",
+        ((order_type, pack, -100 - index) for index, (order_type, pack) in enumerate(
+            (t, p) for t in ORDER_TYPES for p in PACKS
+        )),
+    )
+    conn.execute("INSERT OR IGNORE INTO routes(type, cp_pack, chat_id) VALUES('main', NULL, -99)")
+    conn.executemany(
+        "INSERT INTO cancel_requests(order_id, worker_chat_id, worker_message_id, request_message_id, status)"
+        " VALUES(?, ?, ?, ?, 'pending')",
+        ((order_id, -100, order_id * 2 + 1, order_id * 3) for order_id in range(1, order_count + 1, 10)),
+    )
+    conn.executemany(
+        "INSERT INTO prices(order_id, amount, currency, chat_id, message_id, set_by, created_at)"
+        " VALUES(?, ?, ?, ?, ?, ?, datetime('now', ?))",
+        (
+            (order_id, 10.0, rng.choice(["USD", "TOMAN"]), -100, 10_000_000 + order_id, 1, f"-{order_id % 90} days")
+            for order_id in range(1, order_count + 1, 2)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO processed_updates(update_id, processed_at) VALUES(?, datetime('now', ?))",
+        ((update_id, f"-{update_id % 72} hours") for update_id in range(1, order_count * 2)),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def _calls(db_path: str) -> list[tuple[str, tuple, dict]]:
+    return [
+        ("create_order", (db_path, "safe_fast", 80, 1, 80, "a@example.com", "secret", None), {}),
+        ("set_order_message", (db_path, 1, "customer", 1001, 2), {}),
+        ("set_message_render", (db_path, 1, "customer", "0123456789abcdef", "✅"), {}),
+        ("get_order_for_message", (db_path, 1001, 2), {}),
+        ("get_message_record_for_role", (db_path, 1, "source"), {}),
+        ("get_order_messages", (db_path, 1), {}),
+        ("get_order", (db_path, 1), {}),
+        (
+            "update_order_status",
+            (db_path, 1, "pending", "completed"),
+            {"actor_field": "completed_by", "actor_id": 1, "timestamp_field": "completed_at"},
+        ),
+        ("claim_order", (db_path, 3, 500), {}),
+        ("release_claim", (db_path, 3, 500), {}),
+        ("release_expired_claims", (db_path, 30), {}),
+        ("get_claimed_orders", (db_path, 500), {}),
+        ("set_route", (db_path, "fund", 80, -150), {}),
+        ("list_routes", (db_path,), {}),
+        ("create_cancel_request", (db_path, 2, -100, 5, 6), {}),
+        ("get_cancel_request", (db_path, 2), {}),
+        ("update_cancel_request_status", (db_path, 2, "approved", 1), {}),
+        ("add_prices", (db_path, [(1, 5.0, "USD", -100, 1, 1, "2026-01-01 00:00:00")]), {}),
+        ("get_order_price_totals", (db_path, 1), {}),
+        ("get_price_totals", (db_path, 7), {}),
+        ("add_processed_updates", (db_path, [(1, "2026-01-01 00:00:00")]), {}),
+        ("get_recent_update_ids", (db_path, 1000), {}),
+        ("prune_processed_updates", (db_path, 48), {}),
+        ("save_pending_updates", (db_path, [(1, '{"update_id": 1}')]), {}),
+        ("take_pending_updates", (db_path,), {}),
+    ]
+
+
+def _public_queries() -> set[str]:
+    return {
+        name
+        for name, func in inspect.getmembers(db, inspect.iscoroutinefunction)
+        if not name.startswith("_") and name not in MAINTENANCE_FUNCTIONS
+    }
+
+
+async def audit(db_path: str) -> list[tuple[str, str, list[str]]]:
+    captured: list[tuple[str, Any]] = []
+    db.set_query_observer(lambda sql, params: captured.append((sql, params)))
+    statements: list[tuple[str, str, Any]] = []
+    try:
+        for name, args, kwargs in _calls(db_path):
+            captured.clear()
+            await getattr(db, name)(*args, **kwargs)
+            statements.extend((name, sql, params) for sql, params in captured)
+    finally:
+        db.set_query_observer(None)
+
+    conn = sqlite3.connect(db_path)
+    plans = []
+    for name, sql, params in statements:
+        if sql.lstrip().upper().startswith("PRAGMA"):
+            continue
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        plans.append((name, " ".join(sql.split()), [row[-1] for row in rows]))
+    conn.close()
+    return plans
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check db.py statements for table scans.")
+    parser.add_argument("--orders", type=int, default=50_000, help="orders to seed")
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, "audit.db")
+        asyncio.run(db.init_db(db_path))
+        asyncio.run(db.run_background_migrations(db_path))
+        seed(db_path, args.orders)
+        plans = asyncio.run(audit(db_path))
+
+    failures = []
+    missing = _public_queries() - {name for name, _, _ in _calls("")}
+    for name in sorted(missing):
+        failures.append(f"{name}: not covered by the audit")
+    for name, sql, details in plans:
+        scans = [
+            detail for detail in details
+            if detail.startswith("SCAN") and "CONSTANT ROW" not in detail
+        ]
+        if args.verbose or scans:
+            print(f"{name}: {sql}")
+            for detail in details:
+                print(f"    {detail}")
+        if scans and name not in ALLOWED_SCANS:
+            failures.append(f"{name}: {'; '.join(scans)}")
+
+    if failures:
+        print("\nQuery plan audit failed:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print(f"Query plan audit passed ({len(plans)} statements).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
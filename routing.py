@@ -1,21 +1,63 @@
+import time
+from typing import Optional
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
-import db
+import metrics
+from logs import traced
+from storage import Storage
 from utils import VALID_PACKS, normalize_type
 
 
-async def handle_addsource(update: Update, context: ContextTypes.DEFAULT_TYPE, db_path: str) -> None:
+class RouteCache:
+    def __init__(self, storage: Storage, ttl: float = 60.0) -> None:
+        self._storage = storage
+        self._ttl = ttl
+        self._routes: dict[tuple[str, Optional[int]], int] = {}
+        self._loaded_at: Optional[float] = None
+        self._version: Optional[int] = None
+
+    async def load(self, version: Optional[int] = None) -> int:
+        routes = await self._storage.list_routes()
+        self._routes = {(route["type"], route["cp_pack"]): route["chat_id"] for route in routes}
+        self._loaded_at = time.monotonic()
+        self._version = version
+        return len(self._routes)
+
+    def set(self, order_type: str, cp_pack: Optional[int], chat_id: int) -> None:
+        self._routes[(order_type, cp_pack)] = chat_id
+
+    async def resolve(
+        self, order_type: str, cp_pack: int, version: Optional[int] = None
+    ) -> Optional[int]:
+        if (
+            self._loaded_at is None
+            or version != self._version
+            or time.monotonic() - self._loaded_at >= self._ttl
+        ):
+            await self.load(version)
+        route = self._routes.get((order_type, cp_pack))
+        if route is None:
+            route = self._routes.get(("main", None))
+        return route
+
+
+@metrics.timed("handler")
+@traced
+async def handle_addsource(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     chat = update.effective_chat
     args = context.args
+    storage = context.application.bot_data["storage"]
     if not message or not chat:
         return
     if not args:
         await message.reply_text("Usage: /addsource <type> <pack> or /addsource main")
         return
     if args[0].lower() == "main":
-        await db.set_route(db_path, "main", None, chat.id)
+        await storage.set_route("main", None, chat.id)
+        context.application.bot_data["routes"].set("main", None, chat.id)
         await message.reply_text("Main route set for this group.")
         return
     if len(args) < 2:
@@ -30,15 +72,18 @@ async def handle_addsource(update: Update, context: ContextTypes.DEFAULT_TYPE, d
     if pack not in VALID_PACKS:
         await message.reply_text("Invalid CP pack. Allowed: 80, 420, 880, 2400, 5000, 10800")
         return
-    await db.set_route(db_path, order_type, pack, chat.id)
+    await storage.set_route(order_type, pack, chat.id)
+    context.application.bot_data["routes"].set(order_type, pack, chat.id)
     await message.reply_text(f"Route saved for {order_type} {pack}.")
 
 
-async def handle_listsources(update: Update, context: ContextTypes.DEFAULT_TYPE, db_path: str) -> None:
+@metrics.timed("handler")
+@traced
+async def handle_listsources(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     if not message:
         return
-    routes = await db.list_routes(db_path)
+    routes = await context.application.bot_data["storage"].list_routes()
     if not routes:
         await message.reply_text("No routes configured.")
         return
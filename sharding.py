@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from bisect import bisect
+from typing import Any, Iterable, Optional
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, shards: int, replicas: int = 64) -> None:
+        points = sorted(
+            (_hash(f"{shard}:{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: Any) -> int:
+        index = bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._shards[index]
+
+
+def shard_key(update: dict) -> Any:
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = update.get(field)
+        if message:
+            return message["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return update.get("update_id", 0)
+
+
+def worker_config(config: dict, shard: int) -> dict:
+    shard_config = dict(config)
+    shard_config["shard"] = shard
+    if config["metrics_port"]:
+        shard_config["metrics_port"] = config["metrics_port"] + shard
+    return shard_config
+
+
+async def _run_worker(config: dict, shard: int, queue: multiprocessing.Queue) -> None:
+    from main import build_application
+    from storage import create_storage
+
+    application = build_application(config, create_storage(config))
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logging.info("Shard %s ready", shard)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            payload = await loop.run_in_executor(None, queue.get)
+            if payload is None:
+                break
+            await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logging.info("Shard %s stopped", shard)
+
+
+def _worker_main(config: dict, shard: int, queue: multiprocessing.Queue) -> None:
+    from logs import stop_logging
+    from main import _configure_logging
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    _configure_logging(config)
+    try:
+        asyncio.run(_run_worker(worker_config(config, shard), shard, queue))
+    finally:
+        stop_logging()
+
+
+class ShardFront:
+    def __init__(self, config: dict) -> None:
+        self.config = config
+        self.workers = config["workers"]
+        self.ring = HashRing(self.workers)
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(self.workers)]
+        self._processes: list[Optional[multiprocessing.Process]] = [None] * self.workers
+        self._stopping = asyncio.Event()
+        self._offset: Optional[int] = None
+
+    def _start_worker(self, shard: int) -> None:
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.config, shard, self._queues[shard]),
+            name=f"bot-shard-{shard}",
+        )
+        process.start()
+        self._processes[shard] = process
+        logging.info("Started shard %s (pid %s)", shard, process.pid)
+
+    def _check_workers(self) -> None:
+        for shard, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logging.error("Shard %s exited with code %s; restarting", shard, process.exitcode)
+                self._start_worker(shard)
+
+    def reload(self) -> None:
+        from config import load_config
+        from config_reload import merge_config
+
+        try:
+            self.config, changed, ignored = merge_config(self.config, load_config(reload=True))
+        except RuntimeError:
+            logging.exception("Config reload failed; keeping the current config")
+            return
+        logging.info(
+            "Config reloaded: changed=%s requires_restart=%s",
+            ",".join(changed) or "-",
+            ",".join(ignored) or "-",
+        )
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def dispatch(self, update: dict) -> int:
+        shard = self.ring.shard_for(shard_key(update))
+        self._queues[shard].put(json.dumps(update))
+        return shard
+
+    async def _poll(self, bot: Bot) -> None:
+        while not self._stopping.is_set():
+            try:
+                updates = await bot.get_updates(
+                    offset=self._offset, timeout=10, allowed_updates=Update.ALL_TYPES
+                )
+            except RetryAfter as exc:
+                await asyncio.sleep(exc.retry_after)
+                continue
+            except (TimedOut, NetworkError):
+                logging.warning("get_updates failed; retrying", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update.to_dict())
+                self._offset = update.update_id + 1
+            self._check_workers()
+
+    async def run(self, pending: Iterable[str] = ()) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        for shard in range(self.workers):
+            self._start_worker(shard)
+        requeued = 0
+        for payload in pending:
+            self.dispatch(json.loads(payload))
+            requeued += 1
+        if requeued:
+            logging.info("Re-queued %s update(s) saved at the last shutdown", requeued)
+        bot_kwargs = {"base_url": self.config["base_url"]} if self.config["base_url"] else {}
+        async with Bot(self.config["token"], **bot_kwargs) as bot:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(self._poll(bot))
+            await self._stopping.wait()
+            poller.cancel()
+            try:
+                await poller
+            except asyncio.CancelledError:
+                pass
+            if self._offset is not None:
+                await bot.get_updates(offset=self._offset, timeout=0)
+        await self.stop()
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        if timeout is None:
+            timeout = self.config["shutdown_timeout"] + 30.0
+        for queue in self._queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for shard, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning("Shard %s did not stop in time; terminating", shard)
+                process.terminate()
+
+
+async def _run_front(config: dict) -> None:
+    from storage import create_storage
+
+    storage = create_storage(config)
+    await storage.init()
+    await ShardFront(config).run(await storage.take_pending_updates())
+
+
+def run_front(config: dict) -> None:
+    if config["storage"] != "sqlite":
+        raise RuntimeError("WORKERS > 1 requires STORAGE=sqlite")
+    asyncio.run(_run_front(config))
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import Application
+
+
+class GracefulApplication(Application):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.shutdown_timeout = 20.0
+        self._handler_tasks: set[asyncio.Task] = set()
+        self._background_tasks: set[asyncio.Task] = set()
+        self.unprocessed_updates: list[Update] = []
+        self.drain_stats: dict = {}
+
+    @property
+    def inflight(self) -> int:
+        return len(self._handler_tasks)
+
+    def create_background_task(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _cancel_background_tasks(self) -> None:
+        tasks = list(self._background_tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+            if pending:
+                logging.warning("%s background task(s) did not stop in time", len(pending))
+
+    async def process_update(self, update: object) -> None:
+        task = asyncio.current_task()
+        self._handler_tasks.add(task)
+        try:
+            await super().process_update(update)
+        finally:
+            self._handler_tasks.discard(task)
+
+    def _take_queued_updates(self) -> list[Update]:
+        kept = []
+        taken = []
+        while not self.update_queue.empty():
+            item = self.update_queue.get_nowait()
+            self.update_queue.task_done()
+            if isinstance(item, Update):
+                taken.append(item)
+            else:
+                kept.append(item)
+        for item in kept:
+            self.update_queue.put_nowait(item)
+        return taken
+
+    async def stop(self) -> None:
+        queued = self.update_queue.qsize()
+        inflight = self.inflight
+        started = time.perf_counter()
+        await self._cancel_background_tasks()
+        deadline = started + self.shutdown_timeout
+        while not self.update_queue.empty() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        self.unprocessed_updates = self._take_queued_updates()
+        if self.unprocessed_updates:
+            logging.warning(
+                "Shutdown deadline of %.0fs reached; saving %s queued update(s) for the next start",
+                self.shutdown_timeout,
+                len(self.unprocessed_updates),
+            )
+        await super().stop()
+        self.drain_stats = {
+            "queued": queued,
+            "inflight": inflight,
+            "saved": len(self.unprocessed_updates),
+            "drain_ms": (time.perf_counter() - started) * 1000,
+        }
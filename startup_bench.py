@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+import db
+from fakebotapi import FakeBotAPI
+from query_audit import seed
+
+CUSTOMER_CHAT = 42
+ORDER_TEXT = "safe_fast\n80x1\ncustomer@example.com\npass: secret\nign: player"
+
+
+def _order_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": CUSTOMER_CHAT, "type": "private"},
+            "from": {"id": CUSTOMER_CHAT, "is_bot": False, "first_name": "customer"},
+            "text": ORDER_TEXT,
+        },
+    }
+
+
+async def measure(db_path: str, update_id: int, timeout: float, verbose: bool) -> float:
+    api = FakeBotAPI(latency_ms=0)
+    await api.start()
+    api.push_update(_order_update(update_id))
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:STARTUP",
+        DB_PATH=db_path,
+        STORAGE="sqlite",
+        WORKERS="1",
+        BOT_API_BASE_URL=api.base_url,
+        METRICS_ENABLED="0",
+    )
+    output = None if verbose else asyncio.subprocess.DEVNULL
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+        env=env,
+        stdout=output,
+        stderr=output,
+    )
+    try:
+        while not any(sent["chat_id"] == CUSTOMER_CHAT for sent in api.sent):
+            if process.returncode is not None:
+                raise RuntimeError(f"bot exited with code {process.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("no reply to the first update before the timeout")
+            await asyncio.sleep(0.005)
+        return time.perf_counter() - started
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await api.stop()
+
+
+async def _main(args: argparse.Namespace, db_path: str) -> None:
+    await db.init_db(db_path)
+    await db.run_background_migrations(db_path)
+    seed(db_path, args.orders)
+    results = []
+    for run in range(args.runs):
+        elapsed = await measure(db_path, 10**9 + run, args.timeout, args.verbose)
+        results.append(elapsed)
+        print(f"run {run + 1}: {elapsed * 1000:.0f}ms")
+    print(
+        f"time to first update (ms): min {min(results) * 1000:.0f}"
+        f"  median {statistics.median(results) * 1000:.0f}"
+        f"  max {max(results) * 1000:.0f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure process start to the first reply sent for a queued update."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--orders", type=int, default=20_000, help="orders to seed")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    parser.add_argument("--verbose", action="store_true", help="show bot logs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_main(args, args.db or os.path.join(tmp, "startup.db")))
+
+
+if __name__ == "__main__":
+    main()
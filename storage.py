@@ -0,0 +1,569 @@
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, Mapping, Optional
+
+import db
+
+Row = Mapping[str, Any]
+PriceRow = tuple[int, float, str, int, int, Optional[int], str]
+
+ORDER_ACTOR_FIELDS = {"completed_by", "cancelled_by", "rejected_by"}
+ORDER_TIMESTAMP_FIELDS = {"completed_at"}
+OPEN_STATUSES = {"pending", "pending_cancel"}
+
+
+class Storage(ABC):
+    async def init(self) -> None:
+        pass
+
+    async def run_background_migrations(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def create_order(
+        self,
+        order_type: str,
+        cp_pack: int,
+        cp_qty: int,
+        cp_total: int,
+        email: str,
+        password: str,
+        ign: Optional[str],
+    ) -> int: ...
+
+    @abstractmethod
+    async def set_order_message(
+        self,
+        order_id: int,
+        role: str,
+        chat_id: int,
+        message_id: int,
+        render_hash: Optional[str] = None,
+    ) -> None: ...
+
+    @abstractmethod
+    async def set_message_render(
+        self, order_id: int, role: str, render_hash: Optional[str], reaction: Optional[str]
+    ) -> None: ...
+
+    @abstractmethod
+    async def get_order(self, order_id: int) -> Optional[Row]: ...
+
+    @abstractmethod
+    async def get_order_for_message(self, chat_id: int, message_id: int) -> Optional[Row]: ...
+
+    @abstractmethod
+    async def get_message_record_for_role(self, order_id: int, role: str) -> Optional[Row]: ...
+
+    @abstractmethod
+    async def get_order_messages(self, order_id: int) -> list[Row]: ...
+
+    @abstractmethod
+    async def update_order_status(
+        self,
+        order_id: int,
+        from_status: str,
+        to_status: str,
+        actor_field: Optional[str] = None,
+        actor_id: Optional[int] = None,
+        timestamp_field: Optional[str] = None,
+    ) -> bool: ...
+
+    @abstractmethod
+    async def claim_order(self, order_id: int, worker_id: int) -> bool: ...
+
+    @abstractmethod
+    async def release_claim(self, order_id: int, worker_id: int) -> bool: ...
+
+    @abstractmethod
+    async def release_expired_claims(self, max_age_minutes: int) -> list[int]: ...
+
+    @abstractmethod
+    async def get_claimed_orders(self, worker_id: int) -> list[Row]: ...
+
+    @abstractmethod
+    async def set_route(self, order_type: str, cp_pack: Optional[int], chat_id: int) -> None: ...
+
+    @abstractmethod
+    async def list_routes(self) -> list[Row]: ...
+
+    @abstractmethod
+    async def create_cancel_request(
+        self,
+        order_id: int,
+        worker_chat_id: int,
+        worker_message_id: int,
+        request_message_id: int,
+    ) -> None: ...
+
+    @abstractmethod
+    async def get_cancel_request(self, order_id: int) -> Optional[Row]: ...
+
+    @abstractmethod
+    async def update_cancel_request_status(
+        self, order_id: int, status: str, decided_by: Optional[int]
+    ) -> bool: ...
+
+    @abstractmethod
+    async def add_prices(self, rows: list[PriceRow]) -> None: ...
+
+    @abstractmethod
+    async def get_order_price_totals(self, order_id: int) -> list[Row]: ...
+
+    @abstractmethod
+    async def get_price_totals(self, days: int) -> list[Row]: ...
+
+    @abstractmethod
+    async def add_processed_updates(self, rows: list[tuple[int, str]]) -> None: ...
+
+    @abstractmethod
+    async def get_recent_update_ids(self, limit: int) -> list[int]: ...
+
+    @abstractmethod
+    async def prune_processed_updates(self, max_age_hours: int) -> int: ...
+
+    @abstractmethod
+    async def save_pending_updates(self, rows: list[tuple[int, str]]) -> None: ...
+
+    @abstractmethod
+    async def take_pending_updates(self) -> list[str]: ...
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+
+    async def init(self) -> None:
+        await db.init_db(self.db_path)
+
+    async def run_background_migrations(self) -> None:
+        await db.run_background_migrations(self.db_path)
+
+    async def close(self) -> None:
+        busy, frames, checkpointed = await db.checkpoint_wal(self.db_path)
+        logging.info(
+            "WAL checkpoint %s: %s of %s frames", "busy" if busy else "done", checkpointed, frames
+        )
+
+    async def create_order(
+        self,
+        order_type: str,
+        cp_pack: int,
+        cp_qty: int,
+        cp_total: int,
+        email: str,
+        password: str,
+        ign: Optional[str],
+    ) -> int:
+        return await db.create_order(
+            self.db_path, order_type, cp_pack, cp_qty, cp_total, email, password, ign
+        )
+
+    async def set_order_message(
+        self,
+        order_id: int,
+        role: str,
+        chat_id: int,
+        message_id: int,
+        render_hash: Optional[str] = None,
+    ) -> None:
+        await db.set_order_message(self.db_path, order_id, role, chat_id, message_id, render_hash)
+
+    async def set_message_render(
+        self, order_id: int, role: str, render_hash: Optional[str], reaction: Optional[str]
+    ) -> None:
+        await db.set_message_render(self.db_path, order_id, role, render_hash, reaction)
+
+    async def get_order(self, order_id: int) -> Optional[Row]:
+        return await db.get_order(self.db_path, order_id)
+
+    async def get_order_for_message(self, chat_id: int, message_id: int) -> Optional[Row]:
+        return await db.get_order_for_message(self.db_path, chat_id, message_id)
+
+    async def get_message_record_for_role(self, order_id: int, role: str) -> Optional[Row]:
+        return await db.get_message_record_for_role(self.db_path, order_id, role)
+
+    async def get_order_messages(self, order_id: int) -> list[Row]:
+        return await db.get_order_messages(self.db_path, order_id)
+
+    async def update_order_status(
+        self,
+        order_id: int,
+        from_status: str,
+        to_status: str,
+        actor_field: Optional[str] = None,
+        actor_id: Optional[int] = None,
+        timestamp_field: Optional[str] = None,
+    ) -> bool:
+        return await db.update_order_status(
+            self.db_path, order_id, from_status, to_status, actor_field, actor_id, timestamp_field
+        )
+
+    async def claim_order(self, order_id: int, worker_id: int) -> bool:
+        return await db.claim_order(self.db_path, order_id, worker_id)
+
+    async def release_claim(self, order_id: int, worker_id: int) -> bool:
+        return await db.release_claim(self.db_path, order_id, worker_id)
+
+    async def release_expired_claims(self, max_age_minutes: int) -> list[int]:
+        return await db.release_expired_claims(self.db_path, max_age_minutes)
+
+    async def get_claimed_orders(self, worker_id: int) -> list[Row]:
+        return await db.get_claimed_orders(self.db_path, worker_id)
+
+    async def set_route(self, order_type: str, cp_pack: Optional[int], chat_id: int) -> None:
+        await db.set_route(self.db_path, order_type, cp_pack, chat_id)
+
+    async def list_routes(self) -> list[Row]:
+        return await db.list_routes(self.db_path)
+
+    async def create_cancel_request(
+        self,
+        order_id: int,
+        worker_chat_id: int,
+        worker_message_id: int,
+        request_message_id: int,
+    ) -> None:
+        await db.create_cancel_request(
+            self.db_path, order_id, worker_chat_id, worker_message_id, request_message_id
+        )
+
+    async def get_cancel_request(self, order_id: int) -> Optional[Row]:
+        return await db.get_cancel_request(self.db_path, order_id)
+
+    async def update_cancel_request_status(
+        self, order_id: int, status: str, decided_by: Optional[int]
+    ) -> bool:
+        return await db.update_cancel_request_status(self.db_path, order_id, status, decided_by)
+
+    async def add_prices(self, rows: list[PriceRow]) -> None:
+        await db.add_prices(self.db_path, rows)
+
+    async def get_order_price_totals(self, order_id: int) -> list[Row]:
+        return await db.get_order_price_totals(self.db_path, order_id)
+
+    async def get_price_totals(self, days: int) -> list[Row]:
+        return await db.get_price_totals(self.db_path, days)
+
+    async def add_processed_updates(self, rows: list[tuple[int, str]]) -> None:
+        await db.add_processed_updates(self.db_path, rows)
+
+    async def get_recent_update_ids(self, limit: int) -> list[int]:
+        return await db.get_recent_update_ids(self.db_path, limit)
+
+    async def prune_processed_updates(self, max_age_hours: int) -> int:
+        return await db.prune_processed_updates(self.db_path, max_age_hours)
+
+    async def save_pending_updates(self, rows: list[tuple[int, str]]) -> None:
+        await db.save_pending_updates(self.db_path, rows)
+
+    async def take_pending_updates(self) -> list[str]:
+        return await db.take_pending_updates(self.db_path)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _price_totals(prices: list[dict]) -> list[dict]:
+    totals: dict[str, dict] = {}
+    for price in prices:
+        entry = totals.setdefault(
+            price["currency"],
+            {"currency": price["currency"], "total": 0.0, "count": 0, "order_ids": set()},
+        )
+        entry["total"] += price["amount"]
+        entry["count"] += 1
+        entry["order_ids"].add(price["order_id"])
+    rows = []
+    for currency in sorted(totals):
+        entry = totals[currency]
+        rows.append(
+            {
+                "currency": currency,
+                "total": entry["total"],
+                "count": entry["count"],
+                "orders": len(entry["order_ids"]),
+            }
+        )
+    return rows
+
+
+class MemoryStorage(Storage):
+    def __init__(self) -> None:
+        self._orders: dict[int, dict] = {}
+        self._next_order_id = 1
+        self._messages_by_order: dict[int, dict[str, dict]] = {}
+        self._messages_by_chat: dict[tuple[int, int], dict] = {}
+        self._routes: dict[tuple[str, Optional[int]], int] = {}
+        self._cancel_requests: dict[int, dict] = {}
+        self._prices: list[dict] = []
+        self._prices_by_order: dict[int, list[dict]] = {}
+        self._price_messages: set[tuple[int, int]] = set()
+        self._processed_updates: dict[int, str] = {}
+        self._pending_updates: dict[int, str] = {}
+
+    async def create_order(
+        self,
+        order_type: str,
+        cp_pack: int,
+        cp_qty: int,
+        cp_total: int,
+        email: str,
+        password: str,
+        ign: Optional[str],
+    ) -> int:
+        order_id = self._next_order_id
+        self._next_order_id += 1
+        now = _now()
+        self._orders[order_id] = {
+            "id": order_id,
+            "status": "pending",
+            "type": order_type,
+            "cp_pack": cp_pack,
+            "cp_qty": cp_qty,
+            "cp_total": cp_total,
+            "email": email,
+            "password": password,
+            "ign": ign,
+            "created_at": now,
+            "updated_at": now,
+            "completed_at": None,
+            "completed_by": None,
+            "cancelled_by": None,
+            "rejected_by": None,
+            "claimed_by": None,
+            "claimed_at": None,
+        }
+        return order_id
+
+    async def set_order_message(
+        self,
+        order_id: int,
+        role: str,
+        chat_id: int,
+        message_id: int,
+        render_hash: Optional[str] = None,
+    ) -> None:
+        if order_id not in self._orders:
+            raise ValueError(f"Unknown order {order_id}")
+        roles = self._messages_by_order.setdefault(order_id, {})
+        previous = roles.get(role)
+        if previous is not None:
+            self._messages_by_chat.pop((previous["chat_id"], previous["message_id"]), None)
+        record = {
+            "order_id": order_id,
+            "role": role,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "render_hash": render_hash,
+            "reaction": None,
+        }
+        roles[role] = record
+        self._messages_by_chat[(chat_id, message_id)] = record
+
+    async def set_message_render(
+        self, order_id: int, role: str, render_hash: Optional[str], reaction: Optional[str]
+    ) -> None:
+        record = self._messages_by_order.get(order_id, {}).get(role)
+        if record is not None:
+            record["render_hash"] = render_hash
+            record["reaction"] = reaction
+
+    async def get_order(self, order_id: int) -> Optional[Row]:
+        order = self._orders.get(order_id)
+        return dict(order) if order else None
+
+    async def get_order_for_message(self, chat_id: int, message_id: int) -> Optional[Row]:
+        record = self._messages_by_chat.get((chat_id, message_id))
+        if record is None:
+            return None
+        return {"message_role": record["role"], **self._orders[record["order_id"]]}
+
+    async def get_message_record_for_role(self, order_id: int, role: str) -> Optional[Row]:
+        record = self._messages_by_order.get(order_id, {}).get(role)
+        return dict(record) if record else None
+
+    async def get_order_messages(self, order_id: int) -> list[Row]:
+        return [dict(record) for record in self._messages_by_order.get(order_id, {}).values()]
+
+    async def update_order_status(
+        self,
+        order_id: int,
+        from_status: str,
+        to_status: str,
+        actor_field: Optional[str] = None,
+        actor_id: Optional[int] = None,
+        timestamp_field: Optional[str] = None,
+    ) -> bool:
+        order = self._orders.get(order_id)
+        if order is None or order["status"] != from_status:
+            return False
+        now = _now()
+        order["status"] = to_status
+        order["updated_at"] = now
+        if actor_field and actor_id is not None:
+            if actor_field not in ORDER_ACTOR_FIELDS:
+                raise ValueError(f"Unknown actor field {actor_field}")
+            order[actor_field] = actor_id
+        if timestamp_field:
+            if timestamp_field not in ORDER_TIMESTAMP_FIELDS:
+                raise ValueError(f"Unknown timestamp field {timestamp_field}")
+            order[timestamp_field] = now
+        return True
+
+    async def claim_order(self, order_id: int, worker_id: int) -> bool:
+        order = self._orders.get(order_id)
+        if (
+            order is None
+            or order["status"] not in OPEN_STATUSES
+            or order["claimed_by"] is not None
+        ):
+            return False
+        now = _now()
+        order["claimed_by"] = worker_id
+        order["claimed_at"] = now
+        order["updated_at"] = now
+        return True
+
+    async def release_claim(self, order_id: int, worker_id: int) -> bool:
+        order = self._orders.get(order_id)
+        if order is None or order["status"] not in OPEN_STATUSES or order["claimed_by"] != worker_id:
+            return False
+        order["claimed_by"] = None
+        order["claimed_at"] = None
+        order["updated_at"] = _now()
+        return True
+
+    async def release_expired_claims(self, max_age_minutes: int) -> list[int]:
+        cutoff = (datetime.now(timezone.utc) - timedelta(minutes=max_age_minutes)).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        released = []
+        for order in self._orders.values():
+            if (
+                order["claimed_at"] is not None
+                and order["claimed_at"] < cutoff
+                and order["status"] in OPEN_STATUSES
+            ):
+                order["claimed_by"] = None
+                order["claimed_at"] = None
+                order["updated_at"] = _now()
+                released.append(order["id"])
+        return released
+
+    async def get_claimed_orders(self, worker_id: int) -> list[Row]:
+        claimed = [
+            dict(order)
+            for order in self._orders.values()
+            if order["claimed_by"] == worker_id and order["status"] in OPEN_STATUSES
+        ]
+        return sorted(claimed, key=lambda order: order["claimed_at"])
+
+    async def set_route(self, order_type: str, cp_pack: Optional[int], chat_id: int) -> None:
+        self._routes[(order_type, cp_pack)] = chat_id
+
+    async def list_routes(self) -> list[Row]:
+        keys = sorted(self._routes, key=lambda key: (key[0], key[1] is not None, key[1] or 0))
+        return [
+            {"type": order_type, "cp_pack": cp_pack, "chat_id": self._routes[(order_type, cp_pack)]}
+            for order_type, cp_pack in keys
+        ]
+
+    async def create_cancel_request(
+        self,
+        order_id: int,
+        worker_chat_id: int,
+        worker_message_id: int,
+        request_message_id: int,
+    ) -> None:
+        self._cancel_requests[order_id] = {
+            "order_id": order_id,
+            "worker_chat_id": worker_chat_id,
+            "worker_message_id": worker_message_id,
+            "request_message_id": request_message_id,
+            "status": "pending",
+            "decided_by": None,
+            "decided_at": None,
+        }
+
+    async def get_cancel_request(self, order_id: int) -> Optional[Row]:
+        request = self._cancel_requests.get(order_id)
+        return dict(request) if request else None
+
+    async def update_cancel_request_status(
+        self, order_id: int, status: str, decided_by: Optional[int]
+    ) -> bool:
+        request = self._cancel_requests.get(order_id)
+        if request is None or request["status"] != "pending":
+            return False
+        request.update(status=status, decided_by=decided_by, decided_at=_now())
+        return True
+
+    async def add_prices(self, rows: list[PriceRow]) -> None:
+        for order_id, amount, currency, chat_id, message_id, set_by, created_at in rows:
+            if (chat_id, message_id) in self._price_messages or order_id not in self._orders:
+                continue
+            self._price_messages.add((chat_id, message_id))
+            price = {
+                "order_id": order_id,
+                "amount": amount,
+                "currency": currency,
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "set_by": set_by,
+                "created_at": created_at,
+            }
+            self._prices.append(price)
+            self._prices_by_order.setdefault(order_id, []).append(price)
+
+    async def get_order_price_totals(self, order_id: int) -> list[Row]:
+        rows = _price_totals(self._prices_by_order.get(order_id, []))
+        for row in rows:
+            del row["orders"]
+        return rows
+
+    async def get_price_totals(self, days: int) -> list[Row]:
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        return _price_totals([price for price in self._prices if price["created_at"] >= since])
+
+    async def add_processed_updates(self, rows: list[tuple[int, str]]) -> None:
+        for update_id, processed_at in rows:
+            self._processed_updates.setdefault(update_id, processed_at)
+
+    async def get_recent_update_ids(self, limit: int) -> list[int]:
+        return sorted(self._processed_updates, reverse=True)[:limit]
+
+    async def prune_processed_updates(self, max_age_hours: int) -> int:
+        since = (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        expired = [
+            update_id
+            for update_id, processed_at in self._processed_updates.items()
+            if processed_at < since
+        ]
+        for update_id in expired:
+            del self._processed_updates[update_id]
+        return len(expired)
+
+    async def save_pending_updates(self, rows: list[tuple[int, str]]) -> None:
+        for update_id, payload in rows:
+            self._pending_updates.setdefault(update_id, payload)
+
+    async def take_pending_updates(self) -> list[str]:
+        pending, self._pending_updates = self._pending_updates, {}
+        return [pending[update_id] for update_id in sorted(pending)]
+
+
+def create_storage(config: dict) -> Storage:
+    backend = config.get("storage", "sqlite")
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(config["db_path"])
+    raise RuntimeError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,106 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Hashable, Optional
+
+from telegram.ext import ContextTypes
+
+import metrics
+
+
+class SlidingWindowLimiter:
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self._hits: dict[Hashable, deque[float]] = {}
+        self._last_sweep = time.monotonic()
+
+    def allows(self, key: Hashable, now: float) -> bool:
+        if self.limit <= 0:
+            return True
+        if now - self._last_sweep >= self.window:
+            self._sweep(now)
+        hits = self._hits.get(key)
+        if not hits:
+            return True
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+        return len(hits) < self.limit
+
+    def record(self, key: Hashable, now: float) -> None:
+        if self.limit > 0:
+            self._hits.setdefault(key, deque()).append(now)
+
+    def retry_after(self, key: Hashable, now: Optional[float] = None) -> float:
+        hits = self._hits.get(key)
+        if not hits:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, hits[0] + self.window - now)
+
+    def _sweep(self, now: float) -> None:
+        self._hits = {
+            key: hits for key, hits in self._hits.items() if hits and now - hits[-1] < self.window
+        }
+        self._last_sweep = now
+
+
+class Throttle:
+    def __init__(self, name: str, user_limit: int, chat_limit: int, window: float) -> None:
+        self.name = name
+        self.window = window
+        self._users = SlidingWindowLimiter(user_limit, window)
+        self._chats = SlidingWindowLimiter(chat_limit, window)
+        self._notified: dict[tuple[str, int], float] = {}
+
+    def check(self, user_id: Optional[int], chat_id: int) -> Optional[tuple[str, int, float]]:
+        now = time.monotonic()
+        if user_id is not None and not self._users.allows(user_id, now):
+            return "user", user_id, self._users.retry_after(user_id, now)
+        if not self._chats.allows(chat_id, now):
+            return "chat", chat_id, self._chats.retry_after(chat_id, now)
+        if user_id is not None:
+            self._users.record(user_id, now)
+        self._chats.record(chat_id, now)
+        return None
+
+    def should_notify(self, scope: str, key: int) -> bool:
+        now = time.monotonic()
+        if now - self._notified.get((scope, key), -math.inf) < self.window:
+            return False
+        if len(self._notified) > 10_000:
+            self._notified = {
+                notified_key: at
+                for notified_key, at in self._notified.items()
+                if now - at < self.window
+            }
+        self._notified[(scope, key)] = now
+        return True
+
+
+def build_throttles(config: dict) -> dict[str, Throttle]:
+    window = config["throttle_window"]
+    return {
+        "order": Throttle("order", config["order_user_limit"], config["order_chat_limit"], window),
+        "cancel": Throttle("cancel", config["cancel_user_limit"], config["cancel_chat_limit"], window),
+    }
+
+
+async def throttled(message, context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
+    throttle = context.application.bot_data["throttles"][name]
+    user_id = message.from_user.id if message.from_user else None
+    limited = throttle.check(user_id, message.chat.id)
+    if limited is None:
+        return False
+    scope, key, retry_after = limited
+    if metrics.is_enabled():
+        metrics.increment("throttle", f"{name}_{scope}")
+    if throttle.should_notify(scope, key):
+        logging.info("Throttled %s requests for %s %s", name, scope, key)
+        seconds = max(1, math.ceil(retry_after))
+        await message.reply_text(
+            f"تعداد درخواست‌ها بیش از حد مجاز است. لطفاً {seconds} ثانیه دیگر دوباره تلاش کنید.\n"
+            f"Too many requests. Please try again in {seconds} seconds."
+        )
+    return True
@@ -1,7 +1,11 @@
+import hashlib
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
+import metrics
+
 
 VALID_PACKS = [80, 420, 880, 2400, 5000, 10800]
 
@@ -111,6 +115,7 @@ def parse_ign(lines: list[str]) -> Optional[str]:
     return None
 
 
+@metrics.timed("parse")
 def parse_order(text: str) -> Optional[ParsedOrder]:
     lines = [line.strip() for line in text.splitlines() if line.strip()]
     if len(lines) < 3:
@@ -169,20 +174,47 @@ def canonical_status(status: str) -> tuple[str, str]:
     return mapping.get(status, (status, status))
 
 
-def build_canonical_message(order: dict) -> str:
-    ign_line = f"IGN: {order['ign']} / نام بازی: {order['ign']}\n" if order.get("ign") else ""
-    status_en, status_fa = canonical_status(order["status"])
+@lru_cache(maxsize=4096)
+def _canonical_body(
+    order_id: int,
+    order_type: str,
+    cp_pack: int,
+    cp_qty: int,
+    cp_total: int,
+    email: str,
+    password: str,
+    ign: Optional[str],
+) -> str:
+    ign_line = f"IGN: {ign} / نام بازی: {ign}\n" if ign else ""
     return (
-        f"Order #{order['id']}\n"
-        f"Type: {order['type']} / نوع: {order['type']}\n"
-        f"CP: {order['cp_pack']} x{order['cp_qty']} (Total: {order['cp_total']}) / سی‌پی: {order['cp_pack']} ×{order['cp_qty']} (جمع: {order['cp_total']})\n"
-        f"Email: {order['email']} / ایمیل: {order['email']}\n"
-        f"Password: {order['password']} / رمز: {order['password']}\n"
+        f"Order #{order_id}\n"
+        f"Type: {order_type} / نوع: {order_type}\n"
+        f"CP: {cp_pack} x{cp_qty} (Total: {cp_total}) / سی‌پی: {cp_pack} ×{cp_qty} (جمع: {cp_total})\n"
+        f"Email: {email} / ایمیل: {email}\n"
+        f"Password: {password} / رمز: {password}\n"
         f"{ign_line}"
-        f"Status: {status_en} / وضعیت: {status_fa}"
     )
 
 
+def build_canonical_message(order: dict) -> str:
+    status_en, status_fa = canonical_status(order["status"])
+    body = _canonical_body(
+        order["id"],
+        order["type"],
+        order["cp_pack"],
+        order["cp_qty"],
+        order["cp_total"],
+        order["email"],
+        order["password"],
+        order.get("ign"),
+    )
+    return f"{body}Status: {status_en} / وضعیت: {status_fa}"
+
+
+def render_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
 def is_cancel_text(text: str) -> bool:
     lowered = text.lower().strip()
     return lowered in {"cancel", "کنسل", "لغو"}
@@ -212,3 +244,16 @@ def parse_price_amount(text: str) -> Optional[tuple[float, str]]:
     if toman_match:
         return float(toman_match.group(1).replace(",", ".")), "TOMAN"
     return None
+
+
+def classify_reply(text: str) -> tuple[str, Optional[tuple[float, str]]]:
+    if is_done_text(text):
+        return "done", None
+    if is_wrong_text(text):
+        return "wrong", None
+    if is_cancel_text(text):
+        return "cancel", None
+    price = parse_price_amount(text)
+    if price:
+        return "price", price
+    return "other", None
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+
+class WriteBuffer:
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[list[Any]], Awaitable[None]],
+        max_items: int = 50,
+        max_delay: float = 1.0,
+    ) -> None:
+        self.name = name
+        self._flush_fn = flush_fn
+        self._max_items = max_items
+        self._max_delay = max_delay
+        self._items: list[Any] = []
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._items)
+
+    def add(self, item: Any) -> None:
+        self._items.append(item)
+        if len(self._items) >= self._max_items:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._items:
+            try:
+                await asyncio.wait_for(self._full.wait(), self._max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Failed to flush %s buffer", self.name)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._items:
+                return 0
+            batch, self._items = self._items, []
+            try:
+                await self._flush_fn(batch)
+            except Exception:
+                self._items[:0] = batch
+                raise
+            return len(batch)
+
+    async def close(self) -> int:
+        flushed = await self.flush()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        return flushed